@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+from qs.math import canny_edge, sobel_edge, sobel_edge_detection_img
+
+from .common import synthetic_slice
+
+
+class EdgeDetection:
+    """
+    Edge detectors on a single slice
+    """
+    params = [512, 2048, 4096]
+    param_names = ["size"]
+
+    def setup(self, size):
+        self.img = synthetic_slice(size, size)
+        self.window = (0, int(self.img.max()))
+
+    def time_canny_edge(self, size):
+        canny_edge(self.img, 100, 120, dilation=2, window=self.window)
+
+    def peakmem_canny_edge(self, size):
+        canny_edge(self.img, 100, 120, dilation=2, window=self.window)
+
+    def time_sobel_edge(self, size):
+        sobel_edge(self.img, 100, 120, dilation=2, window=self.window)
+
+    def peakmem_sobel_edge(self, size):
+        sobel_edge(self.img, 100, 120, dilation=2, window=self.window)
+
+    def time_sobel_edge_detection_img(self, size):
+        sobel_edge_detection_img(self.img)
+
+    def peakmem_sobel_edge_detection_img(self, size):
+        sobel_edge_detection_img(self.img)
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from qs.data import Volume, VolumeOptions
+from qs.edges import edge_cache
+from qs.interpolation import (full_linear_interpolation,
+                              full_nonlinear_interpolation,
+                              interval_chains)
+
+from .common import synthetic_lines, write_zarr_volume
+
+SIZE = 512
+
+
+class LinearInterpolation:
+    """
+    Full linear interpolation of segmentations of increasing height
+    """
+    params = ([100, 1000, 5000], [100, 1000])
+    param_names = ["slices", "points"]
+
+    def setup(self, slices, points):
+        self.lines = synthetic_lines(slices, points, key_spacing=50)
+
+    def time_full_linear_interpolation(self, slices, points):
+        full_linear_interpolation(self.lines)
+
+    def peakmem_full_linear_interpolation(self, slices, points):
+        full_linear_interpolation(self.lines)
+
+
+class NonlinearInterpolation:
+    """
+    Full non-linear interpolation, computing edges from a Zarr volume
+    """
+    params = (["canny", "sobel"], [100, 1000])
+    param_names = ["edge_method", "points"]
+    # Every sample starts with empty edge caches
+    number = 1
+    repeat = 5
+    timeout = 300
+
+    def setup_cache(self):
+        return str(write_zarr_volume(Path("interpolation.zarr"),
+                                     (64, SIZE, SIZE)))
+
+    def setup(self, path, edge_method, points):
+        self.vol = Volume(path, options=VolumeOptions(lazy=True))
+        self.lines = synthetic_lines(64, points, key_spacing=16,
+                                     width=SIZE, height=SIZE)
+        edge_cache.clear()
+        interval_chains.clear()
+
+    def teardown(self, path, edge_method, points):
+        self.vol.close()
+
+    def time_full_nonlinear_interpolation(self, path, edge_method, points):
+        full_nonlinear_interpolation(self.lines, self.vol, 20, 40,
+                                     edge_method=edge_method)
+
+    def peakmem_full_nonlinear_interpolation(self, path, edge_method,
+                                             points):
+        full_nonlinear_interpolation(self.lines, self.vol, 20, 40,
+                                     edge_method=edge_method)
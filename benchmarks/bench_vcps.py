@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import os
+import tempfile
+
+from qs.data import cloud_to_dict, load_vcps, write_ordered_vcps
+from qs.interpolation import full_linear_interpolation
+
+from .common import synthetic_lines
+
+
+class VCPS:
+    """
+    Reading and writing ordered pointsets of increasing height
+    """
+    params = ([100, 1000, 5000], [100, 1000])
+    param_names = ["slices", "points"]
+    timeout = 300
+
+    def setup(self, slices, points):
+        self.pointset = full_linear_interpolation(
+            synthetic_lines(slices, points, key_spacing=50))
+        self.cloud = self.pointset.ravel()
+        self.dir = tempfile.TemporaryDirectory()
+        self.seg = "segmentation"
+        os.mkdir(os.path.join(self.dir.name, self.seg))
+        write_ordered_vcps(os.path.join(self.dir.name, self.seg),
+                           self.pointset)
+
+    def teardown(self, slices, points):
+        self.dir.cleanup()
+
+    def time_load_vcps(self, slices, points):
+        load_vcps(self.dir.name, self.seg)
+
+    def peakmem_load_vcps(self, slices, points):
+        load_vcps(self.dir.name, self.seg)
+
+    def time_cloud_to_dict(self, slices, points):
+        cloud_to_dict(self.cloud)
+
+    def time_write_ordered_vcps(self, slices, points):
+        write_ordered_vcps(self.dir.name, self.pointset)
+
+    def peakmem_write_ordered_vcps(self, slices, points):
+        write_ordered_vcps(self.dir.name, self.pointset)
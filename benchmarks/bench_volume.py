@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from qs.data import Volume, VolumeOptions
+
+from .common import write_tif_volume, write_zarr_volume
+
+SLICES = 16
+
+
+class VolumeIO:
+    """
+    Opening volumes and reading slices from both backends
+    """
+    params = (["zarr", "tif"], [512, 2048])
+    param_names = ["backend", "size"]
+    timeout = 300
+
+    def setup_cache(self):
+        paths = dict()
+        for size in self.params[1]:
+            shape = (SLICES, size, size)
+            paths["zarr", size] = str(write_zarr_volume(
+                Path(f"vol-{size}.zarr"), shape))
+            paths["tif", size] = str(write_tif_volume(
+                Path(f"vol-{size}"), shape))
+        return paths
+
+    def setup(self, paths, backend, size):
+        self.path = paths[backend, size]
+        # No caches, so every read goes to the files
+        self.vol = Volume(self.path, options=VolumeOptions(
+            lazy=True, slice_cache_bytes=0, cache_pool_bytes=0))
+
+    def teardown(self, paths, backend, size):
+        self.vol.close()
+
+    def time_open(self, paths, backend, size):
+        Volume(self.path, options=VolumeOptions()).close()
+
+    def peakmem_open(self, paths, backend, size):
+        Volume(self.path, options=VolumeOptions()).close()
+
+    def time_read_slices(self, paths, backend, size):
+        for z in range(SLICES):
+            self.vol[z]
+
+    def time_read_region(self, paths, backend, size):
+        for z in range(SLICES):
+            self.vol.read_region(z, (size // 4, size // 2),
+                                 (size // 4, size // 2))
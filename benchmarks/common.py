@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import tensorstore as ts
+from PIL import Image
+
+
+def synthetic_slice(height: int, width: int, z: int = 0) -> np.ndarray:
+    """
+    Slice with smooth layers and noise, so edge detection has something to
+    find at realistic densities
+
+    :param height: slice height
+    :param width: slice width
+    :param z: slice index, shifts the layers from slice to slice
+    """
+    rng = np.random.default_rng(z)
+    yy, xx = np.mgrid[:height, :width].astype(np.float32)
+    layers = np.sin(yy / 23 + 3 * np.sin(xx / 97) + z / 30)
+    img = 30000 + 15000 * layers + rng.normal(0, 2000, (height, width))
+    return np.clip(img, 0, 65535).astype(np.uint16)
+
+
+def _write_meta(path: Path, shape: Tuple[int, int, int]):
+    with open(path / "meta.json", "w") as f:
+        json.dump({
+            "slices": shape[0],
+            "height": shape[1],
+            "width": shape[2],
+            "voxelsize": 1,
+        }, f)
+
+
+def write_zarr_volume(path: Path, shape: Tuple[int, int, int],
+                      chunks: Tuple[int, int, int] = (16, 256, 256)) -> Path:
+    """
+    Write a synthetic Zarr volume
+
+    :param path: volume directory, ending in .zarr
+    :param shape: (slices, height, width)
+    :param chunks: chunk shape
+    """
+    path = Path(path)
+    data = ts.open({
+        "driver": "zarr",
+        "kvstore": {
+            "driver": "file",
+            "path": str(path),
+        },
+        "metadata": {
+            "shape": list(shape),
+            "chunks": [min(c, s) for c, s in zip(chunks, shape)],
+            "dtype": "<u2",
+            "compressor": {"id": "blosc", "cname": "zstd", "clevel": 3,
+                           "shuffle": 2},
+        },
+        "create": True,
+        "delete_existing": True,
+    }).result()
+    for z in range(shape[0]):
+        data[z].write(synthetic_slice(shape[1], shape[2], z)).result()
+    _write_meta(path, shape)
+    return path
+
+
+def write_tif_volume(path: Path, shape: Tuple[int, int, int]) -> Path:
+    """
+    Write a synthetic slice directory volume of uncompressed TIFFs
+
+    :param path: volume directory
+    :param shape: (slices, height, width)
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    digits = len(str(shape[0]))
+    for z in range(shape[0]):
+        Image.fromarray(synthetic_slice(shape[1], shape[2], z)).save(
+            path / f"{z:0{digits}d}.tif")
+    _write_meta(path, shape)
+    return path
+
+
+def synthetic_lines(num_slices: int, num_points: int, key_spacing: int,
+                    width: int = 512, height: int = 512
+                    ) -> Dict[int, List[List[float]]]:
+    """
+    Segmentation lines with a key slice every key_spacing slices, following
+    the layers of synthetic_slice
+
+    :param num_slices: slices from the first to the last key slice
+    :param num_points: points per key slice
+    :param key_spacing: slices between key slices
+    :param width: width of the volume
+    :param height: height of the volume
+    """
+    keys = list(range(0, num_slices - 1, key_spacing)) + [num_slices - 1]
+    xs = np.linspace(0.1 * width, 0.9 * width, num_points)
+    lines = dict()
+    for z in keys:
+        ys = height / 2 + 0.1 * height * np.sin(xs / 97 + z / 50)
+        lines[z] = [[float(x), float(y), z] for x, y in zip(xs, ys)]
+    return lines
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+from qs.data import VolumeOptions
+from qs.edges import EDGE_DETECTORS, build_edge_volume
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompute the edge maps used by non-linear "
+                    "interpolation and the edge overlay")
+    parser.add_argument('-v', "--input-volpkg", required=True)
+    parser.add_argument("--volume", type=str, required=True)
+    parser.add_argument("--threshold1", type=int, default=100,
+                        help="Lower threshold of the edge detection "
+                             "(default: 100)")
+    parser.add_argument("--threshold2", type=int, default=120,
+                        help="Higher threshold of the edge detection "
+                             "(default: 120)")
+    parser.add_argument("--dilation", type=int, default=2,
+                        help="Size of the dilation kernel (default: 2, as "
+                             "used by quick-segment)")
+    parser.add_argument("--method", choices=sorted(EDGE_DETECTORS),
+                        default="canny", help="Edge detector (default: canny)")
+    parser.add_argument("--z-range", type=int, nargs=2,
+                        metavar=("FIRST", "END"),
+                        help="Only compute slices FIRST to END - 1")
+    parser.add_argument("--processes", type=int,
+                        help="Number of processes computing edges "
+                             "(default: number of CPUs)")
+    VolumeOptions.add_arguments(parser)
+    args = parser.parse_args()
+
+    input_vol_dir = Path(args.input_volpkg) / 'volumes' / args.volume
+
+    start = time.time()
+    path = build_edge_volume(input_vol_dir, t1=args.threshold1,
+                             t2=args.threshold2, dilation=args.dilation,
+                             method=args.method, z_range=args.z_range,
+                             num_processes=args.processes,
+                             options=VolumeOptions.from_args(args))
+    end = time.time()
+    print(f"{end - start} seconds to compute edges into {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import argparse
+import time
+from dataclasses import replace
+from pathlib import Path
+
+from qs.data import Volume, VolumeOptions, build_pyramid
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build a multiscale pyramid for fast zoomed-out browsing")
+    parser.add_argument('-v', "--input-volpkg", required=True)
+    parser.add_argument("--volume", type=str, required=True)
+    parser.add_argument("--factors", type=int, nargs="+",
+                        default=[2, 4, 8, 16],
+                        help="Downsampling factors of the pyramid levels "
+                             "(default: 2 4 8 16)")
+    parser.add_argument("--chunks", type=int, nargs=3, default=[16, 256, 256],
+                        metavar=("Z", "Y", "X"),
+                        help="Chunk shape of the pyramid levels "
+                             "(default: 16 256 256)")
+    VolumeOptions.add_arguments(parser)
+    args = parser.parse_args()
+
+    input_vol_dir = Path(args.input_volpkg) / 'volumes' / args.volume
+
+    # Slices are streamed, so slice directories never need to be fully loaded
+    options = replace(VolumeOptions.from_args(args), lazy=True)
+
+    start = time.time()
+    vol = Volume.from_path(input_vol_dir, options=options)
+    build_pyramid(vol, factors=args.factors, chunks=tuple(args.chunks))
+    end = time.time()
+    print(f"{end - start} seconds to build pyramid for {vol.shape} volume")
+
+
+if __name__ == "__main__":
+    main()
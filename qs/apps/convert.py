@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+from qs.data import COMPRESSORS, convert_to_zarr
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a slice directory volume to a chunked Zarr")
+    parser.add_argument('-v', "--input-volpkg", required=True)
+    parser.add_argument("--volume", type=str, required=True)
+    parser.add_argument("-o", "--output", type=str,
+                        help="Output Zarr directory (default: "
+                             "<volpkg>/volumes/<volume>.zarr)")
+    parser.add_argument("--chunks", type=int, nargs=3, default=[16, 256, 256],
+                        metavar=("Z", "Y", "X"),
+                        help="Chunk shape (default: 16 256 256)")
+    parser.add_argument("--compressor", choices=sorted(COMPRESSORS),
+                        default="blosc-zstd",
+                        help="Chunk compressor (default: blosc-zstd)")
+    parser.add_argument("--level", type=int, default=3,
+                        help="Compression level (default: 3)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of threads used to decode slice images "
+                             "(default: number of CPUs)")
+    parser.add_argument("--max-slabs", type=int, default=None,
+                        help="Number of chunk slabs converted at once, which "
+                             "bounds memory use (default: as many as fit in "
+                             "--memory)")
+    parser.add_argument("--memory", type=float, default=2,
+                        help="Memory budget in GB of the chunk slabs "
+                             "converted at once (default: 2)")
+    args = parser.parse_args()
+
+    volumes_dir = Path(args.input_volpkg) / 'volumes'
+    input_vol_dir = volumes_dir / args.volume
+    output = args.output
+    if output is None:
+        output = volumes_dir / (args.volume + ".zarr")
+
+    start = time.time()
+    output = convert_to_zarr(input_vol_dir, output,
+                             chunks=tuple(args.chunks),
+                             compressor=args.compressor, level=args.level,
+                             num_workers=args.workers,
+                             max_slabs=args.max_slabs,
+                             memory_bytes=int(args.memory * 1024 ** 3))
+    end = time.time()
+    print(f"{end - start} seconds to convert {input_vol_dir} to {output}")
+
+
+if __name__ == "__main__":
+    main()
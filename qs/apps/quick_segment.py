@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import argparse
 import os
+import shutil
 import sys
 import time
 from pathlib import Path
@@ -17,23 +18,26 @@ from matplotlib.backends.backend_qtagg import (FigureCanvasQTAgg as FigCanvas,
                                                NavigationToolbar2QT as NavigationToolbar)
 
 from qs.apps.tutorial import TutorialWindow
-from qs.data import (Volume, fill_seg_list, get_date, get_segmentation_dir,
-                     load_json, load_vcps, write_metadata, write_ordered_vcps,
+from qs.data import (Segmentation, SlicePrefetcher, Volume, VolumeOptions,
+                     fill_seg_list, get_date, get_segmentation_dir, load_json,
+                     load_vcps, write_metadata, write_ordered_vcps_rows,
                      write_seg_json)
-from qs.interpolation import (find_next_key, 
-                              find_previous_key,
-                              interpolate_point,
+from qs.interpolation import (interpolate_point,
                               verify_full_interpolation, 
                               verify_partial_interpolation, 
                               find_normal_direction, 
                               partial_interpolation,
-                              full_interpolation)
+                              iter_full_interpolation)
 from qs.popups import MyPopup, ViewPopUp
-from qs.math import find_min, find_sobel_edge, canny_edge
+from qs.math import find_min, find_sobel_edge
+from qs.edges import slice_edges
 
 # noinspection PyUnresolvedReferences
 import qs.resources
 
+# Most processes interpolating a segmentation when saving, so saving does
+# not start a process for every CPU of large machines each time
+SAVE_MAX_PROCESSES = 8
 
 # -------------------------------------------------------------------
 #                             WINDOW CLASS
@@ -42,7 +46,7 @@ class MainWindow(QtWidgets.QMainWindow):
     ax = None
     bar = None
 
-    def __init__(self, vol, vol_name, seg_dir, initial_slice=0):
+    def __init__(self, vol, vol_name, seg_dir, initial_slice=0, prefetch=8):
         super().__init__()
 
         # -------------initial window specs---------------
@@ -53,6 +57,8 @@ class MainWindow(QtWidgets.QMainWindow):
         self.edge_colormap = colors.ListedColormap(cm.get_cmap('bone', 512)(np.linspace(0.15, 0.85, 256)))
         self.colormap = colors.ListedColormap(cm.get_cmap('viridis', 512)(np.linspace(0, 1, 256)))
         self.vol = vol
+        # Reads the slices ahead of the user while navigating
+        self.slices = SlicePrefetcher(vol, depth=prefetch)
 
         #-----Tutorial window--------------
         self.tutorial_window = TutorialWindow(parent=self)
@@ -304,8 +310,17 @@ class MainWindow(QtWidgets.QMainWindow):
                             "  point. If no edges are found in this distance, it leaves the point\n"
                             "  in the same spot.")
 
-        # Show Canny edges button
-        self.show_edges_check = QtWidgets.QCheckBox("Show Canny Edges")
+        # Edge detector dropdown
+        self.edge_method_dropdown = QtWidgets.QComboBox()
+        self.edge_method_dropdown.addItems(["canny", "sobel"])
+        self.edge_method_dropdown.activated.connect(
+            lambda: self.update_slice(vol, self.slice_slider.value()))
+        edge_method_layout = QtWidgets.QHBoxLayout()
+        edge_method_layout.addWidget(QtWidgets.QLabel("Edge detector:"))
+        edge_method_layout.addWidget(self.edge_method_dropdown)
+
+        # Show edges button
+        self.show_edges_check = QtWidgets.QCheckBox("Show Edges")
         self.show_edges_check.setChecked(False)
         self.show_edges_check.stateChanged.connect(
             lambda: self.update_slice(vol, self.slice_slider.value()))
@@ -364,6 +379,7 @@ class MainWindow(QtWidgets.QMainWindow):
         # Interpolation type label-dropdown pair
         interpolation_opt_layout.addLayout(interpolation_type_layout)
         nonlinear_settings_layout.addWidget(info_box)
+        nonlinear_settings_layout.addLayout(edge_method_layout)
         nonlinear_settings_layout.addLayout(edge_threshold1_layout)
         nonlinear_settings_layout.addLayout(edge_threshold2_layout)
         nonlinear_settings_layout.addLayout(edge_search_limit_layout)
@@ -405,10 +421,11 @@ class MainWindow(QtWidgets.QMainWindow):
         self.insufficient_info.buttonClicked.connect(lambda: False)
         
         # ---------------------------Variable Storage---------------------------------
-        # lines is a dictionary that stores slice -> [list of points (x, y, z)]
+        # lines is a dictionary that stores segmentation -> Segmentation
+        # (key slice -> points)
         self.lines = dict()
         self.active_line = 0
-        self.lines[self.active_line] = dict()
+        self.lines[self.active_line] = Segmentation()
         self.init_x_zoom = self.ax.get_xlim()
         self.init_y_zoom = self.ax.get_ylim()
         self.zoom_width = self.init_x_zoom
@@ -496,19 +513,20 @@ class MainWindow(QtWidgets.QMainWindow):
 
     # draws in the shadows for the key slices
     def draw_shadow(self, line_idx, shadow_color, key_slice):
-        for i in range(len(self.lines[line_idx][key_slice]) - 1):
-            point = self.lines[line_idx][key_slice][i]
-            next_point = self.lines[line_idx][key_slice][i + 1]
+        key_points = self.lines[line_idx][key_slice]
+        for i in range(len(key_points) - 1):
+            point = key_points[i]
+            next_point = key_points[i + 1]
             self.ax.plot([point[0] / self.resolution_div, next_point[0] / self.resolution_div], [point[1] / self.resolution_div, next_point[1] / self.resolution_div],
                          color=shadow_color, alpha=0.5)
             self.ax.add_artist(
                 plt.Circle((point[0] / self.resolution_div, point[1] / self.resolution_div), 3.5 / self.resolution_div, color=shadow_color,
                            alpha=0.5))
-        self.ax.add_artist(plt.Circle((self.lines[line_idx][key_slice][-1][0] / self.resolution_div,
-                                       self.lines[line_idx][key_slice][-1][1] / self.resolution_div),
+        self.ax.add_artist(plt.Circle((key_points[-1][0] / self.resolution_div,
+                                       key_points[-1][1] / self.resolution_div),
                                       3.5 / self.resolution_div, color=shadow_color, alpha=0.5))
-        self.ax.add_artist(plt.Rectangle(((self.lines[line_idx][key_slice][0][0] - 3.5) / self.resolution_div,
-                                          (self.lines[line_idx][key_slice][0][1] - 3.5) / self.resolution_div), 7.5 / self.resolution_div, 7.5 / self.resolution_div,
+        self.ax.add_artist(plt.Rectangle(((key_points[0][0] - 3.5) / self.resolution_div,
+                                          (key_points[0][1] - 3.5) / self.resolution_div), 7.5 / self.resolution_div, 7.5 / self.resolution_div,
                                          color=shadow_color, alpha=1,
                                          zorder=50))
 
@@ -520,12 +538,12 @@ class MainWindow(QtWidgets.QMainWindow):
             length = len(self.lines[self.active_line][slice_num])
             #checking for points
             if (length > 0):
-                #remove the last point drawn from the list
-                self.lines[self.active_line][slice_num].pop()
+                #remove the last point drawn from the list, and the key slice
+                #if there are no more points on it
+                self.lines[self.active_line].pop_point(slice_num)
                 
-                #if there are no more points on the slice, remove the keyslice from the list and drop down
+                #if there are no more points on the slice, remove the keyslice from the drop down
                 if (length == 1):
-                    self.lines[self.active_line].pop(slice_num)
                     index = self.key_slice_drop_down.findText(str(slice_num))
                     self.key_slice_drop_down.removeItem(index)
                 
@@ -549,8 +567,9 @@ class MainWindow(QtWidgets.QMainWindow):
 
             if int(val) in active_lines:
                 # Cycle through points
-                for i in range(len(active_lines[int(val)])):
-                    point = active_lines[int(val)][i]
+                key_points = active_lines[int(val)]
+                for i in range(len(key_points)):
+                    point = key_points[i]
 
                     # Determine if the click was in a point
                     if (((new_point[0] - circle_radius) <= point[0] <= (new_point[0] + circle_radius)) and ((new_point[1] - circle_radius) <= point[1] <= (new_point[1] + circle_radius))):    
@@ -585,9 +604,13 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.ax.clear()
         if (self.show_edges_check.isChecked()):
-            self.ax.imshow(canny_edge(vol[val], int(self.edge_threshold1.text()), int(self.edge_threshold2.text()), dilation=2), cmap=self.edge_colormap)
+            self.ax.imshow(slice_edges(vol, val, int(self.edge_threshold1.text()), int(self.edge_threshold2.text()), dilation=2, method=self.edge_method_dropdown.currentText()), cmap=self.edge_colormap)
         else:
-            picture = vol[val][::self.resolution_div, ::self.resolution_div]
+            if self.resolution_div == 1:
+                picture = self.slices[val]
+            else:
+                # Coarse views read from the volume's pyramid when it has one
+                picture = self.vol.read_slice(val, level=self.resolution_div)
             self.ax.imshow(picture, cmap=self.colormap)        
 
         new_width = []
@@ -624,21 +647,21 @@ class MainWindow(QtWidgets.QMainWindow):
 
             # loading in the points ghost (preview)
             if self.show_shadows_toggle.isChecked() and len(lines) != 0:
+                last_slice, next_slice = lines.index.bracket(int(val))
                 # putting in shadow for the previous key slice
-                last_slice = find_previous_key(int(val), lines)  # previous key slice shadow
-                if last_slice != -1:
-                    self.draw_shadow(uuid, 'black', last_slice[0][2])
+                if last_slice is not None:
+                    self.draw_shadow(uuid, 'black', last_slice)
 
                 # putting in the shadow for the next key slice
-                next_slice = find_next_key(int(val), lines)  # next key slice shadow
-                if next_slice != -1:
-                    self.draw_shadow(uuid, 'white', next_slice[0][2])
+                if next_slice is not None:
+                    self.draw_shadow(uuid, 'white', next_slice)
 
             # loading in the points
             if int(val) in lines:
-                for i in range(len(lines[int(val)]) - 1):
-                    point = lines[int(val)][i]
-                    next_point = lines[int(val)][i + 1]
+                key_points = lines[int(val)]
+                for i in range(len(key_points) - 1):
+                    point = key_points[i]
+                    next_point = key_points[i + 1]
                     self.ax.plot([point[0] / self.resolution_div, next_point[0] / self.resolution_div],
                                     [point[1] / self.resolution_div, next_point[1] / self.resolution_div], color='red')
                     self.ax.add_artist(
@@ -648,10 +671,10 @@ class MainWindow(QtWidgets.QMainWindow):
                                     facecolor='none', edgecolor='red'))
 
                 self.ax.add_artist(
-                    plt.Circle((lines[int(val)][-1][0] / self.resolution_div, lines[int(val)][-1][1] / self.resolution_div),
+                    plt.Circle((key_points[-1][0] / self.resolution_div, key_points[-1][1] / self.resolution_div),
                                 3.5 / self.resolution_div, color='red'))
                 self.ax.add_artist(
-                    plt.Circle((lines[int(val)][-1][0] / self.resolution_div, lines[int(val)][-1][1] / self.resolution_div),
+                    plt.Circle((key_points[-1][0] / self.resolution_div, key_points[-1][1] / self.resolution_div),
                                 circle_size, facecolor='none', edgecolor='red'))
 
             # drawing the interpolated points on slices between keyslices
@@ -663,7 +686,8 @@ class MainWindow(QtWidgets.QMainWindow):
                                       edge_threshold1=int(self.edge_threshold1.text()), 
                                       edge_threshold2=int(self.edge_threshold2.text()),
                                       edge_search_limit=int(self.edge_search_limit.text()),
-                                      circle_size=circle_size
+                                      circle_size=circle_size,
+                                      edge_method=self.edge_method_dropdown.currentText()
                                       )
 
         self.canvas.draw_idle()
@@ -693,8 +717,8 @@ class MainWindow(QtWidgets.QMainWindow):
                     if (event.inaxes == self.ax) and (self.canvas.toolbar.mode == '') and (self.perspective == 'xy'):
                         slice_num = self.slice_slider.value()
                         new_point = [event.xdata * self.resolution_div, event.ydata * self.resolution_div, slice_num]
-                        self.lines[self.active_line].setdefault(slice_num, []).append(
-                            new_point)
+                        self.lines[self.active_line].append(
+                            slice_num, new_point[0], new_point[1])
 
                         # drawing the line between the past and new point
                         if len(self.lines[self.active_line][slice_num]) > 1:
@@ -712,18 +736,18 @@ class MainWindow(QtWidgets.QMainWindow):
                         # Previous slice shadow
                         if self.show_shadows_toggle.isChecked() and len(self.lines[self.active_line][slice_num]) > 0:
                             drawn_points = len(self.lines[self.active_line][slice_num]) - 1
+                            active_lines = self.lines[self.active_line]
+                            last_slice, next_slice = active_lines.index.bracket(int(slice_num))
                             # putting in shadow for the previous key slice
-                            last_slice = find_previous_key(int(slice_num),
-                                                        self.lines[self.active_line])  # previous key slice shadow
-                            if last_slice != -1:
+                            if last_slice is not None:
+                                last_slice = active_lines[last_slice]
                                 self.ax.add_artist(
                                     plt.Circle((last_slice[drawn_points][0] / self.resolution_div, last_slice[drawn_points][1] / self.resolution_div), 7 / self.resolution_div, facecolor='none',
                                             edgecolor='black'))
 
                             # putting in the shadow for the next key slice
-                            next_slice = find_next_key(int(slice_num),
-                                                        self.lines[self.active_line])  # next key slice shadow
-                            if next_slice != -1:
+                            if next_slice is not None:
+                                next_slice = active_lines[next_slice]
                                 self.ax.add_artist(
                                     plt.Circle((next_slice[drawn_points][0] / self.resolution_div, next_slice[drawn_points][1] / self.resolution_div), 7 / self.resolution_div, facecolor='none',
                                             edgecolor='white'))
@@ -745,7 +769,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 if self.xAxisLim == curr_xAxisLim and self.yAxisLim == curr_yAxisLim:
                     if (event.inaxes == self.ax) and (self.canvas.toolbar.mode == ''):
                         # Change the x and y values of the point
-                        self.lines[self.active_line][slice_num][self.clickedPointVal] = [event.xdata, event.ydata, slice_num]
+                        self.lines[self.active_line].set_point(slice_num, self.clickedPointVal, event.xdata, event.ydata)
 
                         # Update the image
                         self.update_slice(self.vol, slice_num)
@@ -945,23 +969,23 @@ class MainWindow(QtWidgets.QMainWindow):
         # determining which button was clicked and incrementing the slice accourdingly
         # if the double arrows are pressed it will move to the nearest key slice in that direction
         # if no keyslices in that direction the slice will jump 50
+        key_slices = self.lines[self.active_line].index
         if type == "Multi Step Decrease":
-            previous_slice = find_previous_key(slice_num,
-                                               self.lines[self.active_line])
-            if previous_slice == -1:
+            previous_slice = key_slices.previous(slice_num)
+            if previous_slice is None:
                 slice_num = slice_num - self.jumpNum
             else:
-                slice_num = previous_slice[0][2]
+                slice_num = previous_slice
         elif type == "Single Step Decrease":
             slice_num = slice_num - 1
         elif type == "Single Step Increase":
             slice_num = slice_num + 1
         elif type == "Multi Step Increase":
-            next_slice = find_next_key(slice_num, self.lines[self.active_line])
-            if next_slice == -1:
+            next_slice = key_slices.next(slice_num)
+            if next_slice is None:
                 slice_num = slice_num + self.jumpNum
             else:
-                slice_num = next_slice[0][2]
+                slice_num = next_slice
 
         # Checking for looping out of bounds
         if slice_num < 0:
@@ -1025,22 +1049,29 @@ class MainWindow(QtWidgets.QMainWindow):
             self.insufficient_info.show()
             return
         uuid = get_date()
-        interpolation = full_interpolation(self.lines[self.active_line], 
-                                           type=self.interpolation_type_dropdown.currentText(), 
-                                           vol=vol,
-                                           edge_threshold1=int(self.edge_threshold1.text()), 
-                                           edge_threshold2=int(self.edge_threshold2.text()),
-                                            edge_search_limit=int(self.edge_search_limit.text()),
-                                           )
-        write_ordered_vcps(get_segmentation_dir(seg_dir, uuid), interpolation)
+        lines = self.lines[self.active_line]
+        # Rows are written as they are interpolated, one slice at a time
+        rows = iter_full_interpolation(lines, 
+                                       type=self.interpolation_type_dropdown.currentText(), 
+                                       vol=vol,
+                                       edge_threshold1=int(self.edge_threshold1.text()), 
+                                       edge_threshold2=int(self.edge_threshold2.text()),
+                                       edge_search_limit=int(self.edge_search_limit.text()),
+                                       edge_method=self.edge_method_dropdown.currentText(),
+                                       num_processes=min(os.cpu_count() or 1, SAVE_MAX_PROCESSES),
+                                       )
+        keys = sorted(lines.keys())
+        write_ordered_vcps_rows(get_segmentation_dir(seg_dir, uuid), rows,
+                                height=keys[-1] - keys[0],
+                                width=len(lines[keys[0]]))
         write_metadata(get_segmentation_dir(seg_dir, uuid), vol_name, uuid)
-        write_seg_json(get_segmentation_dir(seg_dir, uuid),
-                       self.lines[self.active_line])
+        write_seg_json(get_segmentation_dir(seg_dir, uuid), lines)
         QtWidgets.QListWidgetItem(uuid, self.segmentation_list).setCheckState(
             Qt.CheckState.Checked)
 
         if (Path(str(str(seg_dir) + "/fromInterpolator")).is_dir()):
-            write_ordered_vcps(str(str(seg_dir) + "/fromInterpolator"), interpolation)
+            shutil.copyfile(Path(get_segmentation_dir(seg_dir, uuid)) / "pointset.vcps",
+                            Path(str(seg_dir) + "/fromInterpolator") / "pointset.vcps")
             write_metadata(str(str(seg_dir) + "/fromInterpolator"), vol_name, "fromInterpolator")
         print("Points saved out")
 
@@ -1090,6 +1121,23 @@ class MainWindow(QtWidgets.QMainWindow):
         popup = ViewPopUp(self.vol, self.lines[self.active_line])
         popup.exec()
 
+    def popup_advanced_settings(self):
+        self.advanced_settings = MyPopup(self.slices[self.slice_slider.value()],
+                                         int(self.edge_threshold1.text()),
+                                         int(self.edge_threshold2.text()),
+                                         window=self.vol.intensity_window(),
+                                         edge_method=self.edge_method_dropdown.currentText(),
+                                         dilation=2)
+        self.advanced_settings.save_button.clicked.connect(self.save_advanced_settings)
+        self.advanced_settings.show()
+
+    def save_advanced_settings(self):
+        t1, t2 = self.advanced_settings.thresholds()
+        self.edge_threshold1.setText(str(t1))
+        self.edge_threshold2.setText(str(t2))
+        self.advanced_settings.close()
+        self.update_slice(self.vol, self.slice_slider.value())
+
     def set_colormap(self, colormap):
         self.colormap = colormap
         self.update_slice(self.vol, self.slice_slider.value())
@@ -1115,20 +1163,14 @@ class MainWindow(QtWidgets.QMainWindow):
             perspective_slider = int(perspective_slider * vol_height)
 
             # XZ View
-            xs=np.tile(np.arange(0, vol_width), vol_slices)
-            ys=np.full(vol_slices * vol_width, perspective_slider)
-            zs=np.repeat(np.arange(0, vol_slices), vol_width)
-            slice_img = self.vol[zs, ys, xs].reshape(vol_slices, vol_width).transpose()
+            slice_img = self.vol.plane('xz', perspective_slider).transpose()
             self.perspective = 'xz'
         elif view == 'yz':
             perspective_slider = self.slice_slider.value()/(vol_slices)
             perspective_slider = int(perspective_slider * vol_width)
 
             # YZ View
-            xs=np.full(vol_slices * vol_height, perspective_slider)
-            ys=np.repeat(np.arange(0, vol_height), vol_slices)
-            zs=np.tile(np.arange(0, vol_slices), vol_height)
-            slice_img = self.vol[zs, ys, xs].reshape(vol_height, vol_slices).transpose()
+            slice_img = self.vol.plane('yz', perspective_slider)
             self.perspective = 'yz'
 
         self.ax.imshow(slice_img, cmap=self.colormap)
@@ -1184,6 +1226,10 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-v', "--input-volpkg", required=True)
     parser.add_argument("--volume", type=str, required=True)
+    parser.add_argument("--prefetch", type=int, default=8,
+                        help="Number of slices read ahead while navigating "
+                             "(default: 8, 0 disables prefetching)")
+    VolumeOptions.add_arguments(parser)
     args = parser.parse_args()
 
     # ---------saving paths to folders within volume------------
@@ -1196,13 +1242,15 @@ def main():
     # Zarr = new volume representation -> Only loads chuncks which are needed = saves memory and is faster
     # Code from Stephen's volume.py (ink-id)
     start = time.time()
-    vol = Volume.from_path(input_vol_dir)
+    vol = Volume.from_path(input_vol_dir,
+                           options=VolumeOptions.from_args(args))
     end = time.time()
     print(f"{end - start} seconds to initialize {vol.shape} volume")
 
     # creating and loading application window
     app = QtWidgets.QApplication(sys.argv)
-    window = MainWindow(vol, args.volume, segmentation_dir)
+    window = MainWindow(vol, args.volume, segmentation_dir,
+                        prefetch=args.prefetch)
     window.show()
     # allows for exit from the application
     try:
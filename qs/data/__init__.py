@@ -1,2 +1,8 @@
+from .convert import *
+from .options import *
+from .prefetch import *
+from .pyramid import *
+from .segmentation import *
+from .slices import *
 from .vcps import *
 from .volume import *
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+def _nbytes(value) -> int:
+    return getattr(value, "nbytes", 0)
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache bounded by the total size in bytes
+    of the values it holds
+    """
+
+    def __init__(self, max_bytes: int,
+                 sizeof: Callable[[Any], int] = _nbytes):
+        """
+        :param max_bytes: byte budget for all cached values
+        :param sizeof: function returning the size of a value in bytes
+        """
+        self.max_bytes = int(max_bytes)
+        self.nbytes = 0
+        self._sizeof = sizeof
+        self._items: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key: Hashable, value):
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._sizeof(self._items.pop(key))
+            # Values which can never fit are not cached at all
+            if size > self.max_bytes:
+                return
+            self._items[key] = value
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= self._sizeof(evicted)
+
+    def pop(self, key: Hashable, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            value = self._items.pop(key)
+            self.nbytes -= self._sizeof(value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
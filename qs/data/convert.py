@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import tensorstore as ts
+from tqdm import tqdm
+
+from .slices import default_workers, list_slice_files, load_slices
+
+# Compressors selectable by name -> Zarr compressor spec for a level
+COMPRESSORS = {
+    "blosc-zstd": lambda level: {"id": "blosc", "cname": "zstd",
+                                 "clevel": level, "shuffle": 1},
+    "blosc-lz4": lambda level: {"id": "blosc", "cname": "lz4",
+                                "clevel": level, "shuffle": 1},
+    "zlib": lambda level: {"id": "zlib", "level": level},
+    "none": lambda level: None,
+}
+
+# Records which slabs were written, so interrupted conversions can resume
+PROGRESS_FILENAME = ".qs_convert_progress.json"
+
+# Memory budget of the slabs converted at once, when max_slabs is not given
+DEFAULT_CONVERT_MEMORY_BYTES = 2 * 1024 ** 3
+
+
+def _write_json(path: Path, data):
+    # Write through a temporary file so an interruption never leaves a
+    # truncated file behind
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def convert_to_zarr(vol_path: Path, out_path: Path,
+                    chunks: Tuple[int, int, int] = (16, 256, 256),
+                    compressor: str = "blosc-zstd", level: int = 3,
+                    num_workers: Optional[int] = None,
+                    max_slabs: Optional[int] = None,
+                    memory_bytes: int = DEFAULT_CONVERT_MEMORY_BYTES,
+                    progress: bool = True) -> Path:
+    """
+    Convert a slice directory volume into a chunked, compressed Zarr
+
+    Slabs of chunks[0] slices are decoded and written in parallel, with at
+    most max_slabs slabs held in memory at once. Conversion resumes where it
+    stopped if it is run again with the same output, chunk shape and
+    compression, and starts over otherwise. The meta.json of the volume is
+    copied last, once all slabs are written, so Volume only opens complete
+    conversions.
+
+    :param vol_path: slice directory with a meta.json
+    :param out_path: output directory, suffixed with .zarr if it is not
+    :param chunks: (slices, height, width) chunk shape
+    :param compressor: one of COMPRESSORS
+    :param level: compression level
+    :param num_workers: number of threads decoding slice images
+    :param max_slabs: number of slabs converted concurrently (default: as
+        many as fit in memory_bytes, at least one)
+    :param memory_bytes: memory budget of the slabs when max_slabs is None
+    :param progress: whether to show a progress bar
+    """
+    vol_path = Path(vol_path)
+    out_path = Path(out_path)
+    if out_path.suffix != ".zarr":
+        out_path = out_path.with_name(out_path.name + ".zarr")
+
+    with open(vol_path / "meta.json") as f:
+        metadata = json.load(f)
+    shape = (metadata["slices"], metadata["height"], metadata["width"])
+    chunks = tuple(min(c, s) for c, s in zip(chunks, shape))
+    slice_files = list_slice_files(vol_path)
+    if len(slice_files) != shape[0]:
+        raise ValueError(
+            f"meta.json lists {shape[0]} slices but {vol_path} contains "
+            f"{len(slice_files)}")
+
+    if num_workers is None:
+        num_workers = default_workers()
+    if max_slabs is None:
+        slab_bytes = (chunks[0] * shape[1] * shape[2] *
+                      np.dtype(np.uint16).itemsize)
+        max_slabs = min(memory_bytes // slab_bytes, num_workers)
+    max_slabs = max(1, max_slabs)
+    compressor_spec = COMPRESSORS[compressor](level)
+
+    # Resume if a previous run with the same layout was interrupted
+    progress_filename = out_path / PROGRESS_FILENAME
+    done = set()
+    resume = False
+    if progress_filename.exists():
+        with open(progress_filename) as f:
+            previous = json.load(f)
+        resume = (tuple(previous["shape"]) == shape and
+                  tuple(previous["chunks"]) == chunks and
+                  previous.get("compressor", False) == compressor_spec)
+        if resume:
+            done = set(previous["done"])
+
+    spec = {
+        "driver": "zarr",
+        "kvstore": {
+            "driver": "file",
+            "path": str(out_path),
+        },
+        "metadata": {
+            "shape": list(shape),
+            "chunks": list(chunks),
+            "dtype": "<u2",
+            "compressor": compressor_spec,
+        },
+    }
+    data = None
+    if resume:
+        try:
+            # Fails if the array does not match the metadata
+            data = ts.open(spec).result()
+        except ValueError:
+            done = set()
+    if data is None:
+        data = ts.open({**spec, "create": True,
+                        "delete_existing": True}).result()
+
+    lock = threading.Lock()
+
+    def record(z0: int):
+        with lock:
+            done.add(z0)
+            _write_json(progress_filename, {
+                "shape": shape,
+                "chunks": chunks,
+                "compressor": compressor_spec,
+                "done": sorted(done),
+            })
+
+    def convert_slab(z0: int):
+        z1 = min(z0 + chunks[0], shape[0])
+        slab = np.empty((z1 - z0,) + shape[1:], dtype=np.uint16)
+        load_slices(slice_files[z0:z1], slab,
+                    num_workers=max(1, num_workers // max_slabs),
+                    progress=False)
+        data[z0:z1].write(slab).result()
+        record(z0)
+
+    todo = [z0 for z0 in range(0, shape[0], chunks[0]) if z0 not in done]
+    with ThreadPoolExecutor(max_workers=max_slabs) as executor, \
+            tqdm(total=len(todo), disable=not progress) as bar:
+        # Keep at most max_slabs slabs in flight to bound memory
+        pending = set()
+        for z0 in todo:
+            if len(pending) >= max_slabs:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+                    bar.update()
+            pending.add(executor.submit(convert_slab, z0))
+        for future in pending:
+            future.result()
+            bar.update()
+
+    _write_json(out_path / "meta.json", metadata)
+    progress_filename.unlink(missing_ok=True)
+    return out_path
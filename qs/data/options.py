@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import argparse
+import os
+from dataclasses import dataclass, fields, replace
+from typing import Mapping, Optional, Union
+
+_GB = 1024 ** 3
+
+
+def _parse_bool(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _parse_recheck(value: str) -> Union[bool, str]:
+    value = value.strip().lower()
+    if value == "open":
+        return "open"
+    return _parse_bool(value)
+
+
+def _parse_gb(value: str) -> int:
+    return int(float(value) * _GB)
+
+
+@dataclass(frozen=True)
+class VolumeOptions:
+    """
+    Options controlling how a Volume is opened and read
+
+    Options can be set from environment variables (see ENVIRONMENT) and from
+    the quick-segment command line, which takes precedence.
+    """
+    # Slice directory volumes
+    num_workers: Optional[int] = None
+    lazy: bool = False
+    slice_cache_bytes: int = 4 * _GB
+    # Zarr volumes (tensorstore context and spec)
+    cache_pool_bytes: int = 10 * _GB
+    data_copy_concurrency: Optional[int] = None
+    file_io_concurrency: Optional[int] = None
+    recheck_cached_data: Union[bool, str] = "open"
+
+    # Environment variable -> (option, parser)
+    ENVIRONMENT = {
+        "QS_WORKERS": ("num_workers", int),
+        "QS_LAZY": ("lazy", _parse_bool),
+        "QS_SLICE_CACHE_GB": ("slice_cache_bytes", _parse_gb),
+        "QS_CACHE_POOL_GB": ("cache_pool_bytes", _parse_gb),
+        "QS_DATA_COPY_CONCURRENCY": ("data_copy_concurrency", int),
+        "QS_FILE_IO_CONCURRENCY": ("file_io_concurrency", int),
+        "QS_RECHECK_CACHED_DATA": ("recheck_cached_data", _parse_recheck),
+    }
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = os.environ
+                 ) -> VolumeOptions:
+        """
+        Build options from the QS_* environment variables
+
+        :param environ: environment to read the variables from
+        """
+        values = dict()
+        for variable, (name, parse) in cls.ENVIRONMENT.items():
+            if environ.get(variable):
+                values[name] = parse(environ[variable])
+        return cls(**values)
+
+    @staticmethod
+    def add_arguments(parser: argparse.ArgumentParser):
+        """
+        Add the volume options flags to a command line parser
+
+        :param parser: parser to add the flags to
+        """
+        group = parser.add_argument_group("volume options")
+        group.add_argument("--workers", type=int, dest="num_workers",
+                           help="Number of threads used to decode slice "
+                                "images (default: number of CPUs)")
+        group.add_argument("--lazy", action="store_true", default=None,
+                           help="Read slice images on demand instead of "
+                                "loading the whole volume into memory")
+        group.add_argument("--cache-size", type=_parse_gb,
+                           dest="slice_cache_bytes",
+                           help="Size in GB of the slice cache used with "
+                                "--lazy (default: 4)")
+        group.add_argument("--cache-pool-size", type=_parse_gb,
+                           dest="cache_pool_bytes",
+                           help="Size in GB of the Zarr chunk cache "
+                                "(default: 10)")
+        group.add_argument("--data-copy-concurrency", type=int,
+                           help="Number of threads used to decode Zarr chunks "
+                                "(default: number of CPUs)")
+        group.add_argument("--file-io-concurrency", type=int,
+                           help="Number of concurrent Zarr chunk reads")
+        group.add_argument("--recheck-cached-data", type=_parse_recheck,
+                           help="When cached Zarr chunks are revalidated "
+                                "against the store: true, false or open "
+                                "(default: open)")
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> VolumeOptions:
+        """
+        Build options from the environment, overridden by parsed command line
+        flags
+
+        :param args: arguments parsed with a parser set up by add_arguments
+        """
+        values = {f.name: getattr(args, f.name) for f in fields(cls)
+                  if getattr(args, f.name, None) is not None}
+        return replace(cls.from_env(), **values)
+
+    def tensorstore_context(self) -> dict:
+        """
+        Get the tensorstore context spec for these options
+        """
+        context = {
+            "cache_pool": {
+                "total_bytes_limit": self.cache_pool_bytes,
+            }
+        }
+        if self.data_copy_concurrency is not None:
+            context["data_copy_concurrency"] = {
+                "limit": self.data_copy_concurrency}
+        if self.file_io_concurrency is not None:
+            context["file_io_concurrency"] = {
+                "limit": self.file_io_concurrency}
+        return context
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import threading
+from typing import Dict
+
+import numpy as np
+
+from .cache import LRUCache
+from .volume import Volume
+
+
+class SlicePrefetcher:
+    """
+    Reads slices ahead of the user while they navigate a volume
+
+    Every slice request is used to track the direction and stride of
+    navigation. The next slices along that path are read asynchronously and
+    kept in a bounded cache, so stepping through the volume does not wait on
+    the disk.
+    """
+
+    def __init__(self, vol: Volume, depth: int = 8):
+        """
+        :param vol: volume to read slices from
+        :param depth: number of slices to read ahead (0 disables prefetching)
+        """
+        self.vol = vol
+        self.depth = depth
+        # Room for the slices ahead plus the ones just left behind
+        slice_bytes = (vol.shape[1] * vol.shape[2] *
+                       np.dtype(vol.dtype).itemsize)
+        self.cache = LRUCache((2 * depth + 1) * slice_bytes)
+        self._pending: Dict[int, object] = dict()
+        self._lock = threading.RLock()
+        self._last = None
+        self._velocity = 0.0
+
+    def __getitem__(self, z: int) -> np.ndarray:
+        """
+        Get a slice and prefetch the ones the user is likely to view next
+
+        :param z: slice index
+        """
+        z = int(z)
+        # Nothing to gain for volumes which are already in memory
+        if self.depth <= 0 or self.vol.in_memory:
+            return self.vol[z]
+
+        self._observe(z)
+        img = self.get(z)
+        self._prefetch(z)
+        return img
+
+    def get(self, z: int) -> np.ndarray:
+        """
+        Get a slice from the cache or the volume without affecting the
+        navigation tracking
+
+        :param z: slice index
+        """
+        z = int(z)
+        img = self.cache.get(z)
+        if img is not None:
+            return img
+
+        with self._lock:
+            future = self._pending.pop(z, None)
+        img = future.result() if future is not None else self.vol[z]
+        self.cache.put(z, img)
+        return img
+
+    def _observe(self, z: int):
+        if self._last is not None and z != self._last:
+            # Smooth the step so one jump does not reverse the read-ahead
+            step = z - self._last
+            if np.sign(step) != np.sign(self._velocity):
+                self._velocity = float(step)
+            else:
+                self._velocity = 0.5 * self._velocity + 0.5 * step
+        self._last = z
+
+    def _prefetch(self, z: int):
+        if self._velocity == 0:
+            return
+
+        stride = max(1, int(round(abs(self._velocity))))
+        stride *= 1 if self._velocity > 0 else -1
+        targets = [z + stride * i for i in range(1, self.depth + 1)]
+        targets = [t for t in targets if 0 <= t < self.vol.shape[0]]
+
+        with self._lock:
+            # Abandon reads which are no longer on the navigation path
+            for t in list(self._pending):
+                if t not in targets:
+                    self._pending.pop(t).cancel()
+
+            for t in targets:
+                if t in self._pending or t in self.cache:
+                    continue
+                future = self.vol.read_async(t)
+                self._pending[t] = future
+                future.add_done_callback(
+                    lambda f, t=t: self._on_read(t, f))
+
+    def _on_read(self, z: int, future):
+        if future.cancelled():
+            return
+        with self._lock:
+            if self._pending.get(z) is not future:
+                return
+            del self._pending[z]
+        if future.exception() is None:
+            self.cache.put(z, future.result())
+
+    def clear(self):
+        """
+        Drop all cached slices and abandon pending reads
+        """
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+        self.cache.clear()
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import tensorstore as ts
+from tqdm import tqdm
+
+# Name of the multiscale group stored inside the volume directory
+PYRAMID_DIR = "pyramid"
+
+# Version of the pyramid attributes written by build_pyramid
+PYRAMID_VERSION = 1
+
+DEFAULT_COMPRESSOR = {
+    "id": "blosc",
+    "cname": "zstd",
+    "clevel": 3,
+    "shuffle": 2,
+}
+
+
+def pyramid_path(vol_path: Path) -> Path:
+    return Path(vol_path) / PYRAMID_DIR
+
+
+def level_shape(shape: Tuple[int, int, int], factor: int
+                ) -> Tuple[int, int, int]:
+    """
+    Shape of a pyramid level. Slices are kept, each slice is downsampled.
+
+    :param shape: (slices, height, width) of the full resolution volume
+    :param factor: downsampling factor of the level
+    """
+    return (shape[0], -(-shape[1] // factor), -(-shape[2] // factor))
+
+
+def downsample_2x(img: np.ndarray) -> np.ndarray:
+    """
+    Halve the resolution of a slice by averaging 2x2 blocks
+
+    :param img: (height, width) slice; odd edges are padded by replication
+    """
+    pad = ((0, img.shape[0] % 2), (0, img.shape[1] % 2))
+    if any(p[1] for p in pad):
+        img = np.pad(img, pad, mode="edge")
+    mean = (img[0::2, 0::2].astype(np.float32) + img[1::2, 0::2] +
+            img[0::2, 1::2] + img[1::2, 1::2]) * 0.25
+    if np.issubdtype(img.dtype, np.integer):
+        mean = np.rint(mean)
+    return mean.astype(img.dtype)
+
+
+def open_pyramid(vol_path: Path, context: Optional[ts.Context] = None,
+                 recheck_cached_data="open") -> Dict[int, ts.TensorStore]:
+    """
+    Open the levels of a volume's pyramid
+
+    Returns a mapping of downsampling factor to level, which is empty if the
+    volume has no pyramid.
+
+    :param vol_path: path to the volume
+    :param context: tensorstore context shared with the volume
+    :param recheck_cached_data: tensorstore cache revalidation policy
+    """
+    path = pyramid_path(vol_path)
+    attrs_filename = path / ".zattrs"
+    if not attrs_filename.exists():
+        return dict()
+    with open(attrs_filename) as f:
+        pyramid = json.load(f).get("pyramid")
+    if pyramid is None or pyramid.get("version") != PYRAMID_VERSION:
+        return dict()
+
+    levels = dict()
+    for level in pyramid["levels"]:
+        factor = int(level["factor"])
+        spec = {
+            "driver": "zarr",
+            "kvstore": {
+                "driver": "file",
+                "path": str(path / level["path"]),
+            },
+            "recheck_cached_data": recheck_cached_data,
+        }
+        levels[factor] = ts.open(spec, context=context).result()
+    return levels
+
+
+def build_pyramid(vol, factors: Sequence[int] = (2, 4, 8, 16),
+                  chunks: Tuple[int, int, int] = (16, 256, 256),
+                  compressor: Optional[dict] = None, progress: bool = True):
+    """
+    Build a multiscale pyramid of Zarr levels inside a volume directory
+
+    The full resolution level is the volume itself, which is not necessarily
+    Zarr, so the group only lists the downsampled levels in its "pyramid"
+    attributes instead of OME-Zarr multiscales. Every level keeps all slices
+    and downsamples each slice by a power of two with 2x2 averaging. Slabs
+    of chunks[0] slices are processed at a time, so memory is bounded by one
+    slab of the half resolution level.
+
+    :param vol: volume to build the pyramid for
+    :param factors: downsampling factors to store (powers of two)
+    :param chunks: chunk shape of every level
+    :param compressor: Zarr compressor spec (defaults to Blosc Zstd)
+    :param progress: whether to show a progress bar
+    """
+    factors = sorted(int(f) for f in factors)
+    for f in factors:
+        if f < 2 or f & (f - 1):
+            raise ValueError(f"Pyramid factors must be powers of two: {f}")
+    if compressor is None:
+        compressor = DEFAULT_COMPRESSOR
+
+    path = pyramid_path(vol.path)
+    path.mkdir(exist_ok=True)
+    dtype = np.dtype(vol.dtype)
+
+    levels = dict()
+    for f in factors:
+        shape = level_shape(vol.shape, f)
+        levels[f] = ts.open({
+            "driver": "zarr",
+            "kvstore": {
+                "driver": "file",
+                "path": str(path / str(f)),
+            },
+            "metadata": {
+                "shape": list(shape),
+                "chunks": [min(c, s) for c, s in zip(chunks, shape)],
+                "dtype": dtype.str,
+                "compressor": compressor,
+            },
+            "create": True,
+            "delete_existing": True,
+        }).result()
+
+    slab = chunks[0]
+    for z0 in tqdm(range(0, vol.shape[0], slab), disable=not progress):
+        z1 = min(z0 + slab, vol.shape[0])
+        # Issue all the reads of the slab at once
+        reads = [vol.read_async(z) for z in range(z0, z1)]
+        slabs = {f: np.empty((z1 - z0,) + levels[f].shape[1:], dtype=dtype)
+                 for f in factors}
+        for i, read in enumerate(reads):
+            img = read.result()
+            factor = 1
+            while factor < factors[-1]:
+                img = downsample_2x(img)
+                factor *= 2
+                if factor in slabs:
+                    slabs[factor][i] = img
+        writes = [levels[f][z0:z1].write(slabs[f]) for f in factors]
+        for write in writes:
+            write.result()
+
+    with open(path / ".zgroup", "w") as f:
+        json.dump({"zarr_format": 2}, f)
+    with open(path / ".zattrs", "w") as f:
+        json.dump({
+            "pyramid": {
+                "version": PYRAMID_VERSION,
+                "name": vol.path.name,
+                "levels": [{
+                    "path": str(f),
+                    "factor": f,
+                } for f in factors],
+            }
+        }, f, indent=2)
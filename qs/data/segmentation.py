@@ -0,0 +1,320 @@
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import Mapping, MutableMapping
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+class KeySliceIndex:
+    """
+    Sorted key slice numbers of a segmentation
+
+    Answers previous/next/bracket queries with a binary search and is
+    updated incrementally as key slices are added or removed.
+    """
+
+    def __init__(self, keys: Iterable[int] = ()):
+        """
+        :param keys: initial key slice numbers
+        """
+        self._keys: List[int] = sorted(set(keys))
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._keys)
+
+    def __contains__(self, key: int) -> bool:
+        i = bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+    def add(self, key: int):
+        if key not in self:
+            insort(self._keys, key)
+
+    def discard(self, key: int):
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+
+    def clear(self):
+        self._keys.clear()
+
+    def position(self, key: int) -> Optional[int]:
+        """
+        Position of key among the sorted key slices, or None if it is not one
+
+        :param key: slice number
+        """
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return i
+        return None
+
+    def previous(self, current: int) -> Optional[int]:
+        """
+        Last key slice before current, or None if there is none
+
+        :param current: slice number
+        """
+        i = bisect_left(self._keys, current)
+        return self._keys[i - 1] if i > 0 else None
+
+    def next(self, current: int) -> Optional[int]:
+        """
+        First key slice after current, or None if there is none
+
+        :param current: slice number
+        """
+        i = bisect_right(self._keys, current)
+        return self._keys[i] if i < len(self._keys) else None
+
+    def bracket(self, current: int) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Key slices before and after current
+
+        :param current: slice number
+        """
+        return self.previous(current), self.next(current)
+
+    @property
+    def first(self) -> Optional[int]:
+        return self._keys[0] if self._keys else None
+
+    @property
+    def last(self) -> Optional[int]:
+        return self._keys[-1] if self._keys else None
+
+
+def _as_points(points) -> np.ndarray:
+    points = np.asarray(points, dtype=np.float64)
+    if points.size == 0:
+        return np.empty((0, 2), dtype=np.float64)
+    if points.ndim != 2 or points.shape[1] < 2:
+        raise ValueError(f"Expected (N, 2) or (N, 3) points, got shape "
+                         f"{points.shape}")
+    return points[:, :2]
+
+
+# Rows of the first buffer allocated by a growing Segmentation
+MIN_SEGMENTATION_CAPACITY = 64
+
+
+class Segmentation(MutableMapping):
+    """
+    Segmentation lines (key slice number -> points) packed in one buffer
+
+    The (x, y) points of every key slice are contiguous rows of a float64
+    (M, 2) buffer, in key slice order, and index keeps the sorted key slices.
+    Reading a key slice through the mapping interface returns an (N, 3) array
+    with the slice number as z, like the [x, y, z] point lists used
+    elsewhere. points() returns a view of the buffer instead of a copy.
+
+    The buffer has spare rows at its end, so adding or removing points only
+    moves the points of the key slices after them, and it is reallocated
+    (doubling its capacity) only when it is full.
+
+    Key slices always have points: setting one to no points removes it.
+    """
+    __slots__ = ("index", "_buffer", "_starts")
+
+    def __init__(self, lines: Optional[Mapping] = None):
+        """
+        :param lines: key slice number -> (N, 2) or (N, 3) points
+        """
+        self.clear()
+        if lines is None:
+            return
+        if isinstance(lines, Segmentation):
+            self.index = KeySliceIndex(lines.index)
+            self._buffer = lines._buffer[:lines.num_points].copy()
+            self._starts = lines._starts.copy()
+            return
+
+        keys, points = [], []
+        for key in sorted(int(k) for k in lines.keys()):
+            key_points = _as_points(lines[key])
+            if len(key_points):
+                keys.append(key)
+                points.append(key_points)
+        self.index = KeySliceIndex(keys)
+        if points:
+            self._buffer = np.concatenate(points)
+            self._starts = np.concatenate(
+                ([0], np.cumsum([len(p) for p in points]))).astype(np.intp)
+
+    def _position(self, key) -> int:
+        i = self.index.position(int(key))
+        if i is None:
+            raise KeyError(key)
+        return i
+
+    def points(self, key: int) -> np.ndarray:
+        """
+        (N, 2) view of the points of a key slice. The view no longer follows
+        the segmentation once key slices are added or resized.
+
+        :param key: key slice number
+        """
+        i = self._position(key)
+        return self._buffer[self._starts[i]:self._starts[i + 1]]
+
+    def __getitem__(self, key) -> np.ndarray:
+        points = self.points(key)
+        line = np.empty((len(points), 3), dtype=np.float64)
+        line[:, :2] = points
+        line[:, 2] = int(key)
+        return line
+
+    def __setitem__(self, key, points):
+        key = int(key)
+        points = _as_points(points)
+        if not len(points):
+            self.pop(key, None)
+            return
+
+        i = self.index.position(key)
+        if i is None:
+            self.index.add(key)
+            i = self.index.position(key)
+            # The new key slice starts where the next one did
+            self._starts = np.insert(self._starts, i, self._starts[i])
+        start, stop = self._starts[i], self._starts[i + 1]
+        self._splice(start, stop, points)
+        self._starts[i + 1:] += len(points) - (stop - start)
+
+    def __delitem__(self, key):
+        i = self._position(key)
+        start, stop = self._starts[i], self._starts[i + 1]
+        self._splice(start, stop, self._buffer[:0])
+        self._starts = np.delete(self._starts, i + 1)
+        self._starts[i + 1:] -= stop - start
+        self.index.discard(int(key))
+
+    def _splice(self, start: int, stop: int, points: np.ndarray):
+        # Replace rows start:stop with points, moving the rows after them
+        if np.may_share_memory(points, self._buffer):
+            points = points.copy()
+        size = self.num_points
+        new_size = size - (stop - start) + len(points)
+        tail = self._buffer[stop:size]
+        if new_size > len(self._buffer):
+            buffer = np.empty((max(new_size, 2 * len(self._buffer),
+                                   MIN_SEGMENTATION_CAPACITY), 2),
+                              dtype=np.float64)
+            buffer[:start] = self._buffer[:start]
+            self._buffer = buffer
+        # Overlapping copies are buffered by numpy
+        self._buffer[start + len(points):new_size] = tail
+        self._buffer[start:start + len(points)] = points
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key) -> bool:
+        try:
+            return int(key) in self.index
+        except (TypeError, ValueError):
+            return False
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        if sorted(self.keys()) != sorted(int(k) for k in other.keys()):
+            return False
+        return all(np.array_equal(self.points(k), _as_points(other[k]))
+                   for k in self)
+
+    def __repr__(self) -> str:
+        return (f"Segmentation({len(self)} key slices, "
+                f"{self.num_points} points)")
+
+    def append(self, key: int, x: float, y: float):
+        """
+        Add a point at the end of a key slice, creating the key slice if
+        needed
+
+        :param key: key slice number
+        :param x: x coordinate of the point
+        :param y: y coordinate of the point
+        """
+        if key not in self:
+            self[key] = [[x, y]]
+            return
+        i = self._position(key)
+        stop = self._starts[i + 1]
+        self._splice(stop, stop, np.array([(x, y)], dtype=np.float64))
+        self._starts[i + 1:] += 1
+
+    def pop_point(self, key: int, i: int = -1) -> List[float]:
+        """
+        Remove a point of a key slice, and the key slice if it was its last
+        point. Returns the point as [x, y, z].
+
+        :param key: key slice number
+        :param i: position of the point in the key slice
+        """
+        k = self._position(key)
+        start, stop = self._starts[k], self._starts[k + 1]
+        i = range(start, stop)[i]
+        x, y = self._buffer[i].tolist()
+        if stop - start == 1:
+            del self[key]
+        else:
+            self._splice(i, i + 1, self._buffer[:0])
+            self._starts[k + 1:] -= 1
+        return [x, y, int(key)]
+
+    def set_point(self, key: int, i: int, x: float, y: float):
+        """
+        Move a point of a key slice
+
+        :param key: key slice number
+        :param i: position of the point in the key slice
+        :param x: new x coordinate
+        :param y: new y coordinate
+        """
+        self.points(key)[i] = (x, y)
+
+    def clear(self):
+        self.index = KeySliceIndex()
+        self._buffer = np.empty((0, 2), dtype=np.float64)
+        self._starts = np.zeros(1, dtype=np.intp)
+
+    def copy(self) -> Segmentation:
+        return Segmentation(self)
+
+    @property
+    def num_points(self) -> int:
+        return int(self._starts[-1])
+
+    @property
+    def nbytes(self) -> int:
+        return self._buffer.nbytes + self._starts.nbytes
+
+    def to_dict(self) -> dict:
+        """
+        Key slice number -> list of [x, y, z] points, as stored in JSON
+        """
+        return {key: [[x, y, key] for x, y in self.points(key).tolist()]
+                for key in self}
+
+
+def key_slice_index(lines) -> KeySliceIndex:
+    """
+    Get the key slice index of segmentation lines, building one if they are a
+    plain dict. Building one sorts the keys, so get it once and query it
+    rather than calling this for every query.
+
+    :param lines: segmentation lines
+    """
+    index = getattr(lines, 'index', None)
+    if isinstance(index, KeySliceIndex):
+        return index
+    return KeySliceIndex(lines.keys())
@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from .cache import LRUCache
+
+# TIFF tags needed to locate uncompressed strip data
+_TIFF_WIDTH = 256
+_TIFF_HEIGHT = 257
+_TIFF_BITS_PER_SAMPLE = 258
+_TIFF_COMPRESSION = 259
+_TIFF_STRIP_OFFSETS = 273
+_TIFF_SAMPLES_PER_PIXEL = 277
+_TIFF_STRIP_BYTE_COUNTS = 279
+_TIFF_TILE_WIDTH = 322
+_TIFF_SAMPLE_FORMAT = 339
+
+# TIFF field type -> (struct format, size in bytes)
+_TIFF_TYPES = {
+    1: ("B", 1),
+    3: ("H", 2),
+    4: ("I", 4),
+    16: ("Q", 8),
+}
+
+
+def list_slice_files(vol_path: Path) -> List[str]:
+    """
+    Get the sorted list of slice image filenames in a slice directory
+
+    :param vol_path: path to the slice directory
+    """
+    slice_files = []
+    for child in Path(vol_path).iterdir():
+        if not child.is_file():
+            continue
+        # Make sure it is not a hidden file and it's a .tif
+        if child.name[0] != "." and child.suffix == ".tif":
+            slice_files.append(str(child))
+    slice_files.sort()
+    return slice_files
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def read_slice_file(slice_file: str, out: np.ndarray):
+    """
+    Decode a slice image directly into a preallocated array
+
+    :param slice_file: path to the slice image
+    :param out: (height, width) array to write the decoded slice into
+    """
+    with Image.open(slice_file) as img:
+        out[...] = np.asarray(img)
+
+
+def load_slices(slice_files: List[str], out: np.ndarray,
+                num_workers: Optional[int] = None, progress: bool = True):
+    """
+    Decode a list of slice images concurrently into a preallocated volume
+
+    :param slice_files: sorted slice image filenames
+    :param out: (slices, height, width) array that receives the slices
+    :param num_workers: number of decoding threads (defaults to CPU count)
+    :param progress: whether to show a progress bar
+    """
+    if num_workers is None:
+        num_workers = default_workers()
+
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        futures = [executor.submit(read_slice_file, slice_file, out[slice_i])
+                   for slice_i, slice_file in enumerate(slice_files)]
+        with tqdm(total=len(futures), disable=not progress) as bar:
+            for future in as_completed(futures):
+                # Re-raise decoding errors in the calling thread
+                future.result()
+                bar.update()
+
+
+def _read_tiff_tags(f, byte_order: str) -> Optional[dict]:
+    header = f.read(4)
+    if len(header) < 4:
+        return None
+    version = struct.unpack(byte_order + "H", header[2:4])[0]
+    if version == 42:
+        ifd_offset = struct.unpack(byte_order + "I", f.read(4))[0]
+        count_fmt, entry_size, inline_size = "H", 12, 4
+    elif version == 43:
+        # BigTIFF
+        f.read(4)
+        ifd_offset = struct.unpack(byte_order + "Q", f.read(8))[0]
+        count_fmt, entry_size, inline_size = "Q", 20, 8
+    else:
+        return None
+
+    f.seek(ifd_offset)
+    count_size = struct.calcsize(count_fmt)
+    num_entries = struct.unpack(byte_order + count_fmt, f.read(count_size))[0]
+    entries = f.read(num_entries * entry_size)
+
+    tags = dict()
+    for i in range(num_entries):
+        entry = entries[i * entry_size:(i + 1) * entry_size]
+        tag, field_type = struct.unpack(byte_order + "HH", entry[:4])
+        if field_type not in _TIFF_TYPES:
+            continue
+        fmt, size = _TIFF_TYPES[field_type]
+        count = struct.unpack(byte_order + ("I" if version == 42 else "Q"),
+                              entry[4:4 + inline_size])[0]
+        value = entry[4 + inline_size:]
+        if count * size > inline_size:
+            offset = struct.unpack(
+                byte_order + ("I" if version == 42 else "Q"), value)[0]
+            position = f.tell()
+            f.seek(offset)
+            value = f.read(count * size)
+            f.seek(position)
+        tags[tag] = struct.unpack(byte_order + fmt * count,
+                                  value[:count * size])
+    return tags
+
+
+def memmap_slice_file(slice_file: str,
+                      dtype: np.dtype = np.dtype(np.uint16)
+                      ) -> Optional[np.ndarray]:
+    """
+    Memory-map the pixel data of an uncompressed, single-channel TIFF
+
+    Returns None if the file is compressed, tiled, stored in a different data
+    type, or its strips are not contiguous, in which case the slice has to be
+    decoded instead.
+
+    :param slice_file: path to the slice image
+    :param dtype: data type the pixels must be stored as
+    """
+    with open(slice_file, "rb") as f:
+        magic = f.read(2)
+        if magic == b"II":
+            byte_order = "<"
+        elif magic == b"MM":
+            byte_order = ">"
+        else:
+            return None
+        f.seek(0)
+        tags = _read_tiff_tags(f, byte_order)
+
+    if tags is None or _TIFF_TILE_WIDTH in tags:
+        return None
+    if tags.get(_TIFF_COMPRESSION, (1,))[0] != 1:
+        return None
+    if tags.get(_TIFF_SAMPLES_PER_PIXEL, (1,))[0] != 1:
+        return None
+    if _TIFF_STRIP_OFFSETS not in tags or _TIFF_STRIP_BYTE_COUNTS not in tags:
+        return None
+
+    # Only map pixels whose stored type matches the requested one natively
+    stored = np.dtype(byte_order + {1: "u", 2: "i", 3: "f"}.get(
+        tags.get(_TIFF_SAMPLE_FORMAT, (1,))[0], "u") + str(
+        tags.get(_TIFF_BITS_PER_SAMPLE, (1,))[0] // 8))
+    if stored != dtype:
+        return None
+
+    width = tags[_TIFF_WIDTH][0]
+    height = tags[_TIFF_HEIGHT][0]
+    offsets = tags[_TIFF_STRIP_OFFSETS]
+    byte_counts = tags[_TIFF_STRIP_BYTE_COUNTS]
+    for i in range(len(offsets) - 1):
+        if offsets[i] + byte_counts[i] != offsets[i + 1]:
+            return None
+    if sum(byte_counts) < width * height * dtype.itemsize:
+        return None
+
+    return np.memmap(slice_file, dtype=dtype, mode="r", offset=offsets[0],
+                     shape=(height, width))
+
+
+class SliceDirectory:
+    """
+    Lazily loaded stack of slice images
+
+    Slices are only read when indexed and are kept in an LRU cache bounded by
+    a byte budget. Uncompressed TIFFs are memory-mapped rather than decoded.
+    """
+
+    def __init__(self, slice_files: List[str], shape: Tuple[int, int, int],
+                 cache_bytes: int, dtype=np.uint16):
+        """
+        :param slice_files: sorted slice image filenames
+        :param shape: (slices, height, width) of the volume
+        :param cache_bytes: byte budget of the slice cache
+        :param dtype: data type of the returned slices
+        """
+        self.slice_files = slice_files
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.cache = LRUCache(cache_bytes)
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    def get_slice(self, z: int) -> np.ndarray:
+        """
+        Get a single (height, width) slice, reading it if it is not cached
+
+        :param z: slice index
+        """
+        z = int(z)
+        if not -self.shape[0] <= z < self.shape[0]:
+            raise IndexError(
+                f"index {z} is out of bounds for axis 0 with size "
+                f"{self.shape[0]}")
+        z %= self.shape[0]
+
+        img = self.cache.get(z)
+        if img is None:
+            img = memmap_slice_file(self.slice_files[z], self.dtype)
+            if img is None:
+                img = np.empty(self.shape[1:], dtype=self.dtype)
+                read_slice_file(self.slice_files[z], img)
+            self.cache.put(z, img)
+        return img
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        z_key, rest = key[0], key[1:]
+
+        if isinstance(z_key, (int, np.integer)):
+            return self.get_slice(z_key)[rest]
+
+        if isinstance(z_key, slice):
+            zs = range(*z_key.indices(self.shape[0]))
+            if len(zs) == 0:
+                empty = np.empty((0,) + self.shape[1:], self.dtype)
+                return empty[(slice(None),) + rest]
+            return np.stack([self.get_slice(z)[rest] for z in zs])
+
+        # Point-wise gather with integer arrays, e.g. vol[zs, ys, xs]
+        zs = np.asarray(z_key)
+        if len(rest) == 2 and not any(isinstance(k, slice) for k in rest):
+            zs, ys, xs = np.broadcast_arrays(zs, *rest)
+            out = np.empty(zs.shape, dtype=self.dtype)
+            for z in np.unique(zs):
+                mask = zs == z
+                out[mask] = self.get_slice(z)[ys[mask], xs[mask]]
+            return out
+
+        return np.stack([self.get_slice(z) for z in zs.ravel()]).reshape(
+            zs.shape + self.shape[1:])[(Ellipsis,) + rest]
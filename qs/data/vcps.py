@@ -9,6 +9,8 @@ import numpy as np
 from PyQt6 import QtWidgets
 from PyQt6.QtCore import Qt
 
+from .segmentation import Segmentation
+
 
 def fill_seg_list(self, vol, paths_dir, lst):
     for seg in os.listdir(paths_dir):
@@ -25,41 +27,38 @@ def fill_seg_list(self, vol, paths_dir, lst):
 def load_vcps(dir_path, seg):
     with open(os.path.join(dir_path, seg) + "/pointset.vcps", 'rb') as file:
         # print(np.memmap(file, dtype=np.double, mode='r', offset=7))
-        points = file.read().split(b'<>\n')[1]
+        points = file.read().split(b'<>\n', 1)[1]
         return cloud_to_dict(np.frombuffer(points, dtype='float64'))
 
 
 def cloud_to_dict(cloud):
     cloud = np.reshape(cloud, (-1, 3))
-    lines = dict()
-
-    for point in cloud:
-        slice = int(point[2])
-        point = [point[0], point[1], slice]
-        lines.setdefault(int(slice), []).append(point)
-
+    if not len(cloud):
+        return Segmentation()
+
+    # Group the points by slice, keeping their order within each slice
+    slices = cloud[:, 2].astype(int)
+    order = np.argsort(slices, kind='stable')
+    keys, starts = np.unique(slices[order], return_index=True)
+    rows = np.split(cloud[order, :2], starts[1:])
+
+    # If there is no change in direction from one slice to the next, the
+    # slice before was interpolated, otherwise it is a key slice. Directions
+    # are compared on the first point of each slice.
+    first_points = np.array([row[0] for row in rows])
+    diffs = (first_points[1:] - first_points[:-1]).tolist()
+    key_slice = [True] * len(rows)
     # initialize direction vector
     x_diff = 0
     y_diff = 0
+    for i, (dx, dy) in enumerate(diffs):
+        if round(dx, 9) == x_diff and round(dy, 9) == y_diff:
+            key_slice[i] = False
+        x_diff = round(dx, 9)
+        y_diff = round(dy, 9)
 
-    first_key = list(lines.keys())[0]
-    last_key = list(lines.keys())[-1]
-    for line in range(first_key + 1, last_key + 1):
-        # If there is a change in direction that means it is a key slice
-        if (round(lines[line][0][0] - lines[line - 1][0][0], 9) == x_diff) and (
-                round(lines[line][0][1] - lines[line - 1][0][1], 9) == y_diff):
-            x_diff = round(lines[line][0][0] - lines[line - 1][0][0], 9)
-            y_diff = round(lines[line][0][1] - lines[line - 1][0][1], 9)
-            del lines[line - 1]
-        else:
-            x_diff = round(lines[line][0][0] - lines[line - 1][0][0], 9)
-            y_diff = round(lines[line][0][1] - lines[line - 1][0][1], 9)
-
-    # # Printing to verify points
-    # for line in lines:
-    #     print(line, ": ", lines[line])
-
-    return lines
+    return Segmentation({int(key): row for key, row, keep
+                         in zip(keys, rows, key_slice) if keep})
 
 
 def load_json(dir, seg):
@@ -68,7 +67,7 @@ def load_json(dir, seg):
         data = json.load(file, object_hook=lambda d: {int(k): v for k, v in
                                                       d.items()})
 
-    return data
+    return Segmentation(data)
 
 
 def get_date():
@@ -87,27 +86,62 @@ def get_segmentation_dir(paths_dir, uuid):
 
 
 def write_ordered_vcps(path, pointset):
-    # Open output file and write ASCII header
-    file_path = Path(path) / "pointset.vcps"    
-    with file_path.open('wt') as file:
-        file.writelines([
-            f'width: {pointset.shape[1]}\n',
-            f'height: {pointset.shape[0]}\n',
-            f'dim: {pointset.shape[2]}\n',
-            'ordered: true\n',
-            'type: double\n',
-            'version: 1\n',
-            '<>\n'
-        ])
-
-    # Reopen in binary append mode
-    with file_path.open('ab') as file:
-        # Write as doubles
-        pointset.tofile(file)
+    write_ordered_vcps_rows(path, pointset, height=pointset.shape[0],
+                            width=pointset.shape[1], dim=pointset.shape[2])
+
+
+def write_ordered_vcps_rows(path, rows, height, width, dim=3):
+    """
+    Write an ordered pointset one row at a time
+
+    The header is written first, from the known size of the pointset, and
+    every row is appended as it comes, so only one row is held in memory.
+
+    :param path: segmentation directory
+    :param rows: iterable of (width, dim) rows
+    :param height: number of rows
+    :param width: number of points in every row
+    :param dim: number of coordinates of every point
+    """
+    file_path = Path(path) / "pointset.vcps"
+    # Written next to the pointset and moved over it once complete, so a
+    # failed save never leaves a truncated pointset behind
+    tmp_path = file_path.with_name(file_path.name + ".tmp")
+    try:
+        with tmp_path.open('wb') as file:
+            # ASCII header
+            file.write(''.join([
+                f'width: {width}\n',
+                f'height: {height}\n',
+                f'dim: {dim}\n',
+                'ordered: true\n',
+                'type: double\n',
+                'version: 1\n',
+                '<>\n'
+            ]).encode('ascii'))
+
+            # Rows as doubles
+            count = 0
+            for row in rows:
+                row = np.asarray(row, dtype='float64')
+                if row.shape != (width, dim):
+                    raise ValueError(f"Row {count} has shape {row.shape}, "
+                                     f"expected {(width, dim)}")
+                row.tofile(file)
+                count += 1
+
+        if count != height:
+            raise ValueError(f"Wrote {count} rows to {file_path}, expected "
+                             f"{height}")
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
 
 
 def write_seg_json(path, pointset):
-    # Open output file and write ASCII header
+    if isinstance(pointset, Segmentation):
+        pointset = pointset.to_dict()
     with open(path + "/pointset.json", 'w', encoding='utf-8') as file:
         json.dump(pointset, file)
 
@@ -2,13 +2,44 @@ from __future__ import annotations
 
 import json
 import logging
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Tuple
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+from weakref import WeakValueDictionary
 
 import numpy as np
 import tensorstore as ts
-from PIL import Image
-from tqdm import tqdm
+
+from .cache import LRUCache
+from .options import VolumeOptions
+from .pyramid import open_pyramid
+from .slices import (SliceDirectory, default_workers, list_slice_files,
+                     load_slices)
+
+
+def _window_bounds(window) -> Tuple[int, int]:
+    if isinstance(window, slice):
+        if window.start is None or window.stop is None or \
+                window.step not in (None, 1):
+            raise ValueError(
+                f"Region windows need explicit bounds and no step: {window}")
+        return int(window.start), int(window.stop)
+    start, stop = window
+    return int(start), int(stop)
+
+
+# Byte budget of the orthogonal plane cache of each volume
+PLANE_CACHE_BYTES = 1024 ** 3
+
+# Number of outstanding slice reads when reading many slices
+DEFAULT_READ_WINDOW = 64
+
+# Number of slices read at once when reslicing a slice directory
+RESLICE_SLAB_DEPTH = 32
+
+# Number of evenly spaced slices sampled to estimate the intensity window
+INTENSITY_WINDOW_SAMPLES = 16
 
 
 class Volume:
@@ -16,17 +47,68 @@ class Volume:
     NEW VOLUME LOADING AND MANAGING CLASS
     (Zarr or Slice Directory)
     """
-    initialized_volumes: dict[str, Volume] = dict()
+    # Volumes opened with from_path, least recently used first. The registry
+    # only keeps volumes alive while their memory fits in the budget.
+    initialized_volumes: OrderedDict[str, Volume] = OrderedDict()
+    registry_bytes_limit: int = 16 * 1024 ** 3
+    # Every volume opened with from_path which is still referenced somewhere
+    _open_volumes: WeakValueDictionary[str, Volume] = WeakValueDictionary()
+
+    @staticmethod
+    def registry_key(path) -> str:
+        """
+        Normalized registry key, so equivalent str and Path paths match
+        """
+        return str(Path(path).expanduser().resolve())
 
     @classmethod
-    def from_path(cls, path: str) -> Volume:
-        if path in cls.initialized_volumes:
-            return cls.initialized_volumes[path]
-        cls.initialized_volumes[path] = Volume(path)
-        return cls.initialized_volumes[path]
+    def from_path(cls, path: str,
+                  options: Optional[VolumeOptions] = None) -> Volume:
+        key = cls.registry_key(path)
+        vol = cls.initialized_volumes.get(key)
+        if vol is None:
+            # Evicted volumes are reused as long as they are still open
+            vol = cls._open_volumes.get(key)
+        if vol is None or vol.closed:
+            vol = Volume(path, options=options)
+            cls._open_volumes[key] = vol
 
-    def __init__(self, vol_path: str):
+        cls.initialized_volumes[key] = vol
+        cls.initialized_volumes.move_to_end(key)
+        cls._evict()
+        return vol
+
+    @classmethod
+    def _evict(cls):
+        # Drop the registry's references to the least recently used volumes
+        # until the budget is met, always keeping the most recent one
+        total = sum(v.nbytes for v in cls.initialized_volumes.values())
+        while (total > cls.registry_bytes_limit and
+               len(cls.initialized_volumes) > 1):
+            _, vol = cls.initialized_volumes.popitem(last=False)
+            total -= vol.nbytes
+
+    def __init__(self, vol_path: str, options: Optional[VolumeOptions] = None):
+        """
+        :param vol_path: path to a Zarr or a slice directory volume
+        :param options: how to open and read the volume (defaults to the
+            options set in the environment)
+        """
+        if options is None:
+            options = VolumeOptions.from_env()
+        self.options = options
         vol_path = Path(vol_path)
+        self.path = vol_path
+        # Thread pool for asynchronous reads, created on first use
+        self._executor = None
+        # Tensorstore resources shared by the volume and its pyramid
+        self._context = ts.Context(options.tensorstore_context())
+        # Downsampled levels, opened on first use
+        self._pyramid = None
+        # Recently used orthogonal planes
+        self._planes = LRUCache(PLANE_CACHE_BYTES)
+        # Intensity range shared by all slices, estimated on first use
+        self._intensity_window = None
 
         # Load metadata
         self._metadata = dict()
@@ -44,7 +126,7 @@ class Volume:
 
         if vol_path.suffix == ".zarr":
             self._is_zarr = True
-            chunk_size = 256
+            # Chunk shape and dtype come from the store's own .zarray
             self._data = ts.open(
                 {
                     "driver": "zarr",
@@ -52,53 +134,315 @@ class Volume:
                         "driver": "file",
                         "path": str(vol_path),
                     },
-                    "metadata": {
-                        "shape": [self.shape_z, self.shape_y, self.shape_x],
-                        "chunks": [chunk_size, chunk_size, chunk_size],
-                        "dtype": "<u2",
-                    },
-                    "context": {
-                        "cache_pool": {
-                            "total_bytes_limit": 10000000000,
-                        }
-                    }
-                }
+                    "recheck_cached_data": options.recheck_cached_data,
+                },
+                context=self._context
             ).result()
+            if tuple(self._data.shape) != (self.shape_z, self.shape_y,
+                                           self.shape_x):
+                raise ValueError(
+                    f"Zarr shape {tuple(self._data.shape)} does not match "
+                    f"meta.json shape "
+                    f"{(self.shape_z, self.shape_y, self.shape_x)}")
         else:
             self._is_zarr = False
             # Get list of slice image filenames
-            slice_files = []
-            for child in vol_path.iterdir():
-                if not child.is_file():
-                    continue
-                # Make sure it is not a hidden file and it's a .tif
-                if child.name[0] != "." and child.suffix == ".tif":
-                    slice_files.append(str(child))
-            slice_files.sort()
+            slice_files = list_slice_files(vol_path)
             assert len(slice_files) == self.shape_z
 
-            # Load slice images into volume
-            logging.info("Loading volume slices from {}...".format(vol_path))
+            if options.lazy:
+                # Slices are read when first accessed
+                self._data = SliceDirectory(
+                    slice_files, (self.shape_z, self.shape_y, self.shape_x),
+                    options.slice_cache_bytes)
+            else:
+                # Load slice images into volume
+                logging.info(
+                    "Loading volume slices from {}...".format(vol_path))
 
-            self._data = np.empty(
-                (self.shape_z, self.shape_y, self.shape_x),
-                dtype=np.uint16
-            )
-            for slice_i, slice_file in tqdm(list(enumerate(slice_files))):
-                img = np.array(Image.open(slice_file), dtype=np.uint16).copy()
-                self._data[slice_i, :, :] = img
-            print()
+                self._data = np.empty(
+                    (self.shape_z, self.shape_y, self.shape_x),
+                    dtype=np.uint16
+                )
+                # Decode slices concurrently, straight into the volume array
+                load_slices(slice_files, self._data,
+                            num_workers=options.num_workers)
+                print()
 
     def __getitem__(self, key):
-        # TODO consider adding bounds checking and return 0 if not in bounds (to match previous implementation)
-        #   It would be nice to avoid that if possible (doesn't affect ML performance), though, because
-        #   it breaks the intuition around the array access.
-       
+        # Indexing is not bounds checked so that it keeps the intuition of
+        # array access. Use read_region for zero-padded reads near the borders.
+        self._check_open()
         if self._is_zarr:
             return self._data[key].read().result()
         else:
             return self._data[key]
 
+    def _check_open(self):
+        # Every read entry point fails the same way once the volume is closed
+        if self._data is None:
+            raise ValueError(f"Volume {self.path} is closed")
+
+    def read_region(self, z: int, ys, xs, pad=0) -> np.ndarray:
+        """
+        Read a window of a slice, padding the parts outside the volume
+
+        Only the part of the window inside the volume is read, so Zarr
+        volumes only load the chunks which overlap it.
+
+        :param z: slice index
+        :param ys: rows of the window, as slice(y0, y1) or (y0, y1)
+        :param xs: columns of the window, as slice(x0, x1) or (x0, x1)
+        :param pad: value of the pixels outside the volume
+        """
+        self._check_open()
+        (y0, y1), (x0, x1) = (_window_bounds(ys), _window_bounds(xs))
+        region = np.full((max(0, y1 - y0), max(0, x1 - x0)), pad,
+                         dtype=self.dtype)
+
+        # Clip the window to the volume
+        cy0, cy1 = max(y0, 0), min(y1, self.shape_y)
+        cx0, cx1 = max(x0, 0), min(x1, self.shape_x)
+        if 0 <= z < self.shape_z and cy0 < cy1 and cx0 < cx1:
+            region[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0] = \
+                self[int(z), cy0:cy1, cx0:cx1]
+        return region
+
+    def intensity_window(self) -> Tuple[int, int]:
+        """
+        (low, high) intensities stretched over 0-255 for edge detection
+
+        The window is shared by all slices so that edges do not flicker
+        between neighbouring slices, and so windows of a slice are
+        normalized like the whole slice. It is estimated once from the
+        maximum of INTENSITY_WINDOW_SAMPLES evenly spaced slices.
+        """
+        if self._intensity_window is None:
+            samples = np.unique(np.linspace(
+                0, self.shape_z - 1,
+                min(INTENSITY_WINDOW_SAMPLES, self.shape_z)).round())
+            high = max(int(img.max()) for img in self.read_slices(samples))
+            self._intensity_window = (0, max(high, 1))
+        return self._intensity_window
+
+    def set_intensity_window(self, window: Tuple[int, int]):
+        """
+        Use a known intensity window instead of estimating it, e.g. the
+        window of the same volume opened in another process
+
+        :param window: (low, high) intensities stretched over 0-255
+        """
+        self._intensity_window = (int(window[0]), int(window[1]))
+
+    def close(self):
+        """
+        Release the volume's data, caches and threads
+
+        The volume is removed from the registry and can no longer be read.
+        """
+        key = self.registry_key(self.path)
+        if Volume.initialized_volumes.get(key) is self:
+            del Volume.initialized_volumes[key]
+        if Volume._open_volumes.get(key) is self:
+            del Volume._open_volumes[key]
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._planes.clear()
+        self._pyramid = None
+        self._data = None
+        self._context = None
+
+    @property
+    def closed(self) -> bool:
+        return self._data is None
+
+    def __enter__(self) -> Volume:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory the volume holds or may hold in its caches, in bytes
+        """
+        if self.closed:
+            return 0
+        if self._is_zarr:
+            data_bytes = self.options.cache_pool_bytes
+        elif self.in_memory:
+            data_bytes = self._data.nbytes
+        else:
+            data_bytes = self._data.cache.nbytes
+        return data_bytes + self._planes.nbytes
+
+    def read_async(self, key):
+        """
+        Start reading part of the volume without waiting for the data
+
+        Returns a future whose result() is the same array vol[key] returns.
+        Zarr volumes issue an asynchronous tensorstore read, lazy slice
+        directories decode on a thread pool and in-memory volumes complete
+        immediately.
+
+        :param key: index into the volume, as used with vol[key]
+        """
+        self._check_open()
+        if self._is_zarr:
+            return self._data[key].read()
+        if self.in_memory:
+            future = Future()
+            future.set_result(self._data[key])
+            return future
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.options.num_workers or default_workers())
+        return self._executor.submit(self._data.__getitem__, key)
+
+    @property
+    def levels(self) -> List[int]:
+        """
+        Downsampling factors the volume can be read at without striding
+        (1 is the full resolution)
+        """
+        if self._pyramid is None:
+            self._pyramid = open_pyramid(
+                self.path, context=self._context,
+                recheck_cached_data=self.options.recheck_cached_data)
+        return [1] + sorted(self._pyramid)
+
+    def read_level(self, z, level: int, ys: slice = slice(None),
+                   xs: slice = slice(None)) -> np.ndarray:
+        """
+        Read a slice or a region of a slice from a pyramid level
+
+        :param z: slice index (or slice of slice indices)
+        :param level: downsampling factor, one of vol.levels
+        :param ys: rows to read, in the level's coordinates
+        :param xs: columns to read, in the level's coordinates
+        """
+        self._check_open()
+        if level == 1:
+            return self[z, ys, xs]
+        if level not in self.levels:
+            raise ValueError(
+                f"No pyramid level {level} for {self.path} "
+                f"(available: {self.levels})")
+        return self._pyramid[level][z, ys, xs].read().result()
+
+    def read_slice(self, z: int, level: int = 1) -> np.ndarray:
+        """
+        Read a slice downsampled by an integer factor
+
+        Uses the coarsest pyramid level that divides the factor and strides
+        over the rest, so the result matches vol[z][::level, ::level] in shape
+        while reading a fraction of the data.
+
+        :param z: slice index
+        :param level: downsampling factor
+        """
+        base = max(f for f in self.levels if level % f == 0)
+        step = level // base
+        return self.read_level(z, base)[::step, ::step]
+
+    def read_slices(self, indices: Iterable[int],
+                    window: int = DEFAULT_READ_WINDOW) -> Iterator[np.ndarray]:
+        """
+        Read several slices concurrently, yielding them in order
+
+        Up to window reads are outstanding at once, which keeps the storage
+        busy while bounding the memory held by slices read ahead.
+
+        :param indices: slice indices to read
+        :param window: maximum number of slices being read at once
+        """
+        reads = deque()
+        for z in indices:
+            reads.append(self.read_async(int(z)))
+            if len(reads) >= window:
+                yield reads.popleft().result()
+        while reads:
+            yield reads.popleft().result()
+
+    def iter_slices(self, slices: Union[range, slice] = slice(None),
+                    window: int = DEFAULT_READ_WINDOW) -> Iterator[np.ndarray]:
+        """
+        Read a range of slices concurrently, yielding them in order
+
+        :param slices: range or slice of slice indices (defaults to all)
+        :param window: maximum number of slices being read at once
+        """
+        if isinstance(slices, slice):
+            slices = range(*slices.indices(self.shape_z))
+        return self.read_slices(slices, window=window)
+
+    def plane(self, view: str, index: int) -> np.ndarray:
+        """
+        Read an orthogonal plane through the whole volume
+
+        The volume is read in chunk-aligned slabs of slices which are all
+        requested at once, and recently used planes are cached.
+
+        :param view: 'xz' for the (slices, width) plane at row index, or 'yz'
+            for the (slices, height) plane at column index
+        :param index: row or column the plane goes through
+        """
+        self._check_open()
+        index = int(index)
+        if view == 'xz':
+            in_slice = (index, slice(None))
+            shape = (self.shape_z, self.shape_x)
+        elif view == 'yz':
+            in_slice = (slice(None), index)
+            shape = (self.shape_z, self.shape_y)
+        else:
+            raise ValueError(f"Unknown plane view: {view}")
+
+        key = (view, index)
+        plane = self._planes.get(key)
+        if plane is not None:
+            return plane
+
+        if self.in_memory:
+            plane = np.ascontiguousarray(self._data[(slice(None),) + in_slice])
+        else:
+            depth = self.chunks[0] if self._is_zarr else RESLICE_SLAB_DEPTH
+            slabs = [slice(z0, min(z0 + depth, self.shape_z))
+                     for z0 in range(0, self.shape_z, depth)]
+            reads = [self.read_async((slab,) + in_slice) for slab in slabs]
+            plane = np.empty(shape, dtype=self.dtype)
+            for slab, read in zip(slabs, reads):
+                plane[slab] = read.result()
+
+        self._planes.put(key, plane)
+        return plane
+
+    @property
+    def in_memory(self) -> bool:
+        """
+        Whether the whole volume is loaded in memory
+        """
+        return isinstance(self._data, np.ndarray)
+
     @property
     def shape(self) -> Tuple[int, ...]:
-        return self._data.shape
+        return tuple(self._data.shape)
+
+    @property
+    def dtype(self) -> np.dtype:
+        if self._is_zarr:
+            return self._data.dtype.numpy_dtype
+        return self._data.dtype
+
+    @property
+    def chunks(self) -> Tuple[int, ...]:
+        """
+        Shape of the chunks the volume is stored in (a single slice for slice
+        directories)
+        """
+        if self._is_zarr:
+            return tuple(self._data.chunk_layout.read_chunk.shape)
+        return (1, self.shape_y, self.shape_x)
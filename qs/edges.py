@@ -0,0 +1,637 @@
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from math import sqrt
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, Iterator, Optional, Tuple
+
+import cv2 as cv
+import numpy as np
+import tensorstore as ts
+from tqdm import tqdm
+
+from qs.data import Volume, VolumeOptions
+from qs.data.cache import LRUCache
+from qs.math import canny_edge, normalize_intensity, sobel_edge
+
+# Edge detectors selectable by name, all returning 0/255 uint8 edge maps and
+# taking the intensity window the image is normalized with
+EDGE_DETECTORS = {
+    'canny': canny_edge,
+    'sobel': sobel_edge,
+}
+
+# Edge detectors which can run on a window of a slice and match the result on
+# the whole slice (their normalization only depends on the intensity window)
+REGION_DETECTORS = {'canny'}
+
+# Byte budget of the default edge map cache (bit-packed, so 8x as many pixels)
+DEFAULT_EDGE_CACHE_BYTES = 512 * 1024 ** 2
+
+# Name of the directory holding precomputed edge volumes inside a volume
+EDGE_VOLUME_DIR = "edges"
+
+EDGE_VOLUME_COMPRESSOR = {
+    "id": "blosc",
+    "cname": "zstd",
+    "clevel": 3,
+    "shuffle": 0,
+}
+
+# Extra pixels first read around a window, doubled until the edge components
+# reaching the window are closed inside the region read
+EDGE_REGION_MARGIN = 16
+
+# Pixels of Canny edge candidates depend on the image within this distance
+# (3x3 gradient, then non-maximum suppression against the neighbours)
+CANNY_REACH = 2
+
+
+class EdgeMapCache:
+    """
+    LRU cache of edge maps keyed by (volume, slice, t1, t2, dilation, method)
+
+    Edge maps are binary, so they are stored bit-packed and expanded back to
+    0/255 uint8 images when retrieved.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_EDGE_CACHE_BYTES):
+        """
+        :param max_bytes: byte budget of the packed edge maps
+        """
+        self._cache = LRUCache(max_bytes, sizeof=lambda item: item[0].nbytes)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._cache
+
+    @property
+    def nbytes(self) -> int:
+        return self._cache.nbytes
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        item = self._cache.get(key)
+        if item is None:
+            return None
+        packed, width = item
+        return np.unpackbits(packed, axis=-1, count=width) * np.uint8(255)
+
+    def put(self, key: Hashable, edges: np.ndarray):
+        self._cache.put(key, (np.packbits(edges > 0, axis=-1), edges.shape[-1]))
+
+    def clear(self):
+        self._cache.clear()
+
+
+# Edge maps shared by the viewer and the interpolation functions
+edge_cache = EdgeMapCache()
+
+
+def volume_key(vol) -> Hashable:
+    """
+    Identify a volume in cache keys
+
+    :param vol: a Volume, or any array-like indexed by slice
+    """
+    path = getattr(vol, 'path', None)
+    if path is not None:
+        # Same key for every spelling of the path, like Volume.from_path
+        return Volume.registry_key(path)
+    return id(vol)
+
+
+def volume_window(vol) -> Optional[Tuple[int, int]]:
+    """
+    Intensity window used to normalize the slices of a volume for edge
+    detection, or None to normalize each image by its own maximum
+
+    :param vol: a Volume, or any array-like indexed by slice
+    """
+    if hasattr(vol, 'intensity_window'):
+        return tuple(vol.intensity_window())
+    return None
+
+
+def edge_volume_path(vol_path: Path, t1=100, t2=120, dilation=1,
+                     method='canny') -> Path:
+    """
+    Path of the precomputed edges of a volume for a set of parameters
+
+    :param vol_path: path to the volume
+    :param t1: lower threshold for the edge detection
+    :param t2: higher threshold for the edge detection
+    :param dilation: size of dilation kernel (size 1 means no dilation)
+    :param method: edge detector, one of EDGE_DETECTORS
+    """
+    return (Path(vol_path) / EDGE_VOLUME_DIR /
+            f"{method}-{t1}-{t2}-{dilation}")
+
+
+# Opened edge volumes: .zattrs path -> (modification time, store, attrs)
+_edge_volumes: Dict[str, Tuple[int, ts.TensorStore, dict]] = dict()
+
+
+def open_edge_volume(vol, t1=100, t2=120, dilation=1, method='canny'
+                     ) -> Optional[Tuple[ts.TensorStore, dict]]:
+    """
+    Open the precomputed edges of a volume built with build_edge_volume
+
+    Returns the bit-packed edge store and its attributes, or None if no edges
+    were precomputed with these parameters and the volume's intensity window.
+    Rebuilt edge volumes are picked up on the next call.
+
+    :param vol: volume the edges belong to
+    :param t1: lower threshold for the edge detection
+    :param t2: higher threshold for the edge detection
+    :param dilation: size of dilation kernel (size 1 means no dilation)
+    :param method: edge detector, one of EDGE_DETECTORS
+    """
+    vol_path = getattr(vol, 'path', None)
+    if vol_path is None:
+        return None
+    path = edge_volume_path(vol_path, t1, t2, dilation, method)
+    attrs_filename = path / ".zattrs"
+    try:
+        mtime = attrs_filename.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    entry = _edge_volumes.get(str(attrs_filename))
+    if entry is None or entry[0] != mtime:
+        with open(attrs_filename) as f:
+            attrs = json.load(f)
+        store = ts.open({
+            "driver": "zarr",
+            "kvstore": {
+                "driver": "file",
+                "path": str(path),
+            },
+        }).result()
+        entry = (mtime, store, attrs)
+        _edge_volumes[str(attrs_filename)] = entry
+    window = volume_window(vol)
+    if entry[2].get("window") != (None if window is None else list(window)):
+        return None
+    return entry[1], entry[2]
+
+
+def stored_slice_edges(vol, z: int, t1=100, t2=120, dilation=1,
+                       method='canny') -> Optional[np.ndarray]:
+    """
+    Read the precomputed edge map of a slice, or None if it was not
+    precomputed with these parameters
+
+    :param vol: volume the slice belongs to
+    :param z: slice index
+    :param t1: lower threshold for the edge detection
+    :param t2: higher threshold for the edge detection
+    :param dilation: size of dilation kernel (size 1 means no dilation)
+    :param method: edge detector, one of EDGE_DETECTORS
+    """
+    stored = open_edge_volume(vol, t1, t2, dilation, method)
+    if stored is None:
+        return None
+    store, attrs = stored
+    z = int(z)
+    if not any(z0 <= z < z1 for z0, z1 in attrs["slices"]):
+        return None
+    packed = store[z].read().result()
+    return np.unpackbits(packed, axis=-1, count=attrs["width"]) * \
+        np.uint8(255)
+
+
+def slice_edges(vol, z: int, t1=100, t2=120, dilation=1, method='canny',
+                cache: EdgeMapCache = edge_cache) -> np.ndarray:
+    """
+    Get the edge map of a slice, computing it only if it is neither cached
+    nor precomputed
+
+    :param vol: volume the slice belongs to
+    :param z: slice index
+    :param t1: lower threshold for the edge detection
+    :param t2: higher threshold for the edge detection
+    :param dilation: size of dilation kernel (size 1 means no dilation)
+    :param method: edge detector, one of EDGE_DETECTORS
+    :param cache: edge map cache to use
+    """
+    window = volume_window(vol)
+    key = (volume_key(vol), int(z), t1, t2, dilation, method, window)
+    edges = cache.get(key)
+    if edges is not None:
+        return edges
+    edges = stored_slice_edges(vol, z, t1, t2, dilation, method)
+    if edges is None:
+        edges = EDGE_DETECTORS[method](vol[int(z)], t1, t2,
+                                       dilation=dilation, window=window)
+    cache.put(key, edges)
+    return edges
+
+
+def iter_slice_edges(vol, indices: Iterable[int], t1=100, t2=120,
+                     dilation=1, method='canny',
+                     cache: EdgeMapCache = edge_cache
+                     ) -> Iterator[np.ndarray]:
+    """
+    Get the edge maps of several slices in order
+
+    Slices whose edge maps are not cached are read concurrently when the
+    volume supports it.
+
+    :param vol: volume the slices belong to
+    :param indices: slice indices
+    :param t1: lower threshold for the edge detection
+    :param t2: higher threshold for the edge detection
+    :param dilation: size of dilation kernel (size 1 means no dilation)
+    :param method: edge detector, one of EDGE_DETECTORS
+    :param cache: edge map cache to use
+    """
+    if open_edge_volume(vol, t1, t2, dilation, method) is not None:
+        # Precomputed edges are read instead of the slices
+        for z in indices:
+            yield slice_edges(vol, z, t1, t2, dilation, method, cache=cache)
+        return
+
+    vol_key = volume_key(vol)
+    window = volume_window(vol)
+    indices = [int(z) for z in indices]
+    missing = list(dict.fromkeys(
+        z for z in indices
+        if (vol_key, z, t1, t2, dilation, method, window) not in cache))
+    if hasattr(vol, 'read_slices'):
+        images = vol.read_slices(missing)
+    else:
+        images = (vol[z] for z in missing)
+
+    pending = set(missing)
+    for z in indices:
+        if z in pending:
+            pending.discard(z)
+            edges = EDGE_DETECTORS[method](next(images), t1, t2,
+                                           dilation=dilation, window=window)
+            cache.put((vol_key, z, t1, t2, dilation, method, window), edges)
+        else:
+            # Computes the edges again if they were evicted in the meantime
+            edges = slice_edges(vol, z, t1, t2, dilation, method,
+                                cache=cache)
+        yield edges
+
+
+def _region_canny(vol, z: int, need, t1, t2, window, margin: int):
+    """
+    Canny edges of a region of a slice, exact inside the box need, with the
+    (y, x) origin of the region. None if the region would cover most of the
+    slice.
+
+    Canny's hysteresis keeps the edge candidates (cv.Canny(t1, t1)) which
+    are 8-connected to a strong edge (cv.Canny(t2, t2)). Both are computed on
+    the box plus a margin, which is doubled until no candidate component
+    reaching the box touches the pixels of the region whose candidates
+    depend on the image outside it.
+    """
+    height, width = vol.shape[1:]
+    y0, y1, x0, x1 = need
+    margin = max(margin, CANNY_REACH)
+    while True:
+        ry0, ry1 = max(y0 - margin, 0), min(y1 + margin, height)
+        rx0, rx1 = max(x0 - margin, 0), min(x1 + margin, width)
+        if (ry1 - ry0) * (rx1 - rx0) >= height * width // 2:
+            return None
+        img = normalize_intensity(
+            vol.read_region(z, (ry0, ry1), (rx0, rx1)), window)
+        candidates = cv.Canny(img, t1, t1)
+        strong = cv.Canny(img, t2, t2)
+
+        # Candidates are only exact away from the sides inside the slice
+        ty0 = CANNY_REACH if ry0 > 0 else 0
+        tx0 = CANNY_REACH if rx0 > 0 else 0
+        ty1 = ry1 - ry0 - (CANNY_REACH if ry1 < height else 0)
+        tx1 = rx1 - rx0 - (CANNY_REACH if rx1 < width else 0)
+        trusted = np.zeros_like(candidates)
+        trusted[ty0:ty1, tx0:tx1] = candidates[ty0:ty1, tx0:tx1]
+        count, labels = cv.connectedComponents(trusted, connectivity=8)
+
+        # Components on the trusted border may go on outside the region
+        open_labels = np.zeros(count, dtype=bool)
+        if ty0:
+            open_labels[labels[ty0, tx0:tx1]] = True
+        if ty1 < ry1 - ry0:
+            open_labels[labels[ty1 - 1, tx0:tx1]] = True
+        if tx0:
+            open_labels[labels[ty0:ty1, tx0]] = True
+        if tx1 < rx1 - rx0:
+            open_labels[labels[ty0:ty1, tx1 - 1]] = True
+        open_labels[0] = False
+        inner = labels[y0 - ry0:y1 - ry0, x0 - rx0:x1 - rx0]
+        if not open_labels[inner].any():
+            break
+        margin *= 2
+
+    keep = np.zeros(count, dtype=bool)
+    keep[labels[(strong > 0) & (labels > 0)]] = True
+    return np.where(keep[labels], np.uint8(255), np.uint8(0)), (ry0, rx0)
+
+
+def region_edges(vol, z: int, ys, xs, t1=100, t2=120, dilation=1,
+                 method='canny', cache: EdgeMapCache = edge_cache,
+                 margin: int = EDGE_REGION_MARGIN) -> np.ndarray:
+    """
+    Get the edge map of a slice, computing edges only inside a window
+
+    Edges inside the window are the same as those of slice_edges. Canny's
+    hysteresis is not local, so the region read around the window grows
+    until the edges reaching the window are complete (see _region_canny).
+    The map has the shape of the whole slice and is empty outside the
+    window. The whole slice edges are used instead when they are already
+    cached or precomputed, when the region would cover most of the slice,
+    or when the detector or volume does not support windows.
+
+    :param vol: volume the slice belongs to
+    :param z: slice index
+    :param ys: rows of the window, as (y0, y1)
+    :param xs: columns of the window, as (x0, x1)
+    :param t1: lower threshold for the edge detection
+    :param t2: higher threshold for the edge detection
+    :param dilation: size of dilation kernel (size 1 means no dilation)
+    :param method: edge detector, one of EDGE_DETECTORS
+    :param cache: edge map cache holding whole slice edges
+    :param margin: pixels first read around the window
+    """
+    z = int(z)
+    window = volume_window(vol)
+    key = (volume_key(vol), z, t1, t2, dilation, method, window)
+    if (method not in REGION_DETECTORS or key in cache or window is None or
+            not hasattr(vol, 'read_region') or
+            open_edge_volume(vol, t1, t2, dilation, method) is not None):
+        return slice_edges(vol, z, t1, t2, dilation, method, cache=cache)
+
+    height, width = vol.shape[1:]
+    y0, y1 = max(int(ys[0]), 0), min(int(ys[1]), height)
+    x0, x1 = max(int(xs[0]), 0), min(int(xs[1]), width)
+    edges = np.zeros((height, width), dtype=np.uint8)
+    if y0 >= y1 or x0 >= x1:
+        return edges
+
+    # The dilation spreads the edges within its size into the window
+    need = (max(y0 - dilation, 0), min(y1 + dilation, height),
+            max(x0 - dilation, 0), min(x1 + dilation, width))
+    result = _region_canny(vol, z, need, t1, t2, window, margin)
+    if result is None:
+        # Not worth it for windows covering most of the slice
+        return slice_edges(vol, z, t1, t2, dilation, method, cache=cache)
+
+    region_map, (ry0, rx0) = result
+    region_map = cv.dilate(region_map, np.ones((dilation, dilation), np.uint8),
+                           iterations=1)
+    edges[y0:y1, x0:x1] = region_map[y0 - ry0:y1 - ry0, x0 - rx0:x1 - rx0]
+    return edges
+
+
+class EdgeDistanceMap:
+    """
+    Edge map with the distance from every pixel of a window to its nearest
+    edge, for many single edge searches on the same edge map
+
+    The distance transform is computed once, so rays which start farther
+    from every edge than they can travel are rejected without being walked,
+    and the others are only read from the first step which can reach an
+    edge. The transform uses the chessboard distance, which is exact, cheap
+    and never more than the Euclidean distance.
+    """
+
+    def __init__(self, edge_data: np.ndarray, ys=None, xs=None,
+                 threshold: int = 10):
+        """
+        :param edge_data: edge map, where pixels >= threshold are edges
+        :param ys: rows of the window, as (y0, y1) (default: all)
+        :param xs: columns of the window, as (x0, x1) (default: all)
+        :param threshold: smallest value of an edge pixel
+        """
+        self.edges = np.asarray(edge_data)
+        self.threshold = threshold
+        height, width = self.edges.shape[:2]
+        ys = (0, height) if ys is None else ys
+        xs = (0, width) if xs is None else xs
+        self.y0, self.y1 = max(int(ys[0]), 0), min(int(ys[1]), height)
+        self.x0, self.x1 = max(int(xs[0]), 0), min(int(xs[1]), width)
+        self.y1, self.x1 = max(self.y1, self.y0), max(self.x1, self.x0)
+
+        # Non-edge pixels are non-zero, so the transform measures the
+        # distance to the nearest edge pixel
+        background = np.uint8(
+            self.edges[self.y0:self.y1, self.x0:self.x1] < threshold)
+        if background.size and not background.all():
+            self.distance = cv.distanceTransform(background, cv.DIST_C, 3)
+        else:
+            self.distance = np.full(background.shape, np.inf,
+                                    dtype=np.float32)
+
+    @classmethod
+    def around(cls, edge_data: np.ndarray, points, radius: float,
+               threshold: int = 10) -> EdgeDistanceMap:
+        """
+        Distance map of the window of an edge map within radius of points
+
+        :param edge_data: edge map, where pixels >= threshold are edges
+        :param points: (N, 2+) x, y points
+        :param radius: distance around the points covered by the window
+        :param threshold: smallest value of an edge pixel
+        """
+        xy = np.asarray(points, dtype=np.float64)[:, :2]
+        radius = int(np.ceil(radius))
+        x0, y0 = np.floor(xy.min(axis=0)).astype(int) - radius
+        x1, y1 = np.ceil(xy.max(axis=0)).astype(int) + radius + 1
+        return cls(edge_data, (y0, y1), (x0, x1), threshold)
+
+    def detect_edge_along_line(self, point, direction, magnitude=40):
+        """
+        Same as qs.interpolation.detect_edge_along_line: the first position
+        of the unit steps from point along direction that lands on an edge,
+        or -1 if none is found within magnitude steps
+
+        :param point: x, y, z starting point
+        :param direction: x, y, z search direction
+        :param magnitude: number of steps to take
+        """
+        vec_size = sqrt(direction[0] ** 2 + direction[1] ** 2 +
+                        direction[2] ** 2)
+        step_x = direction[0] / vec_size
+        step_y = direction[1] / vec_size
+        x = point[0]
+        y = point[1]
+
+        # Step i lands less than i + 1 + 2 sqrt(2) pixels away from the
+        # starting pixel, so no step before the distance to the nearest edge
+        # minus that can land on an edge. Only points whose steps all stay
+        # in the window are pruned, as edges outside it are not measured.
+        first = 0
+        wx, wy = int(x) - self.x0, int(y) - self.y0
+        reach = magnitude + 1 + 2 * sqrt(2)
+        if (reach <= wx < self.x1 - self.x0 - reach and
+                reach <= wy < self.y1 - self.y0 - reach):
+            first = self.distance[wy, wx] - 1 - 2 * sqrt(2)
+            if first >= magnitude:
+                return -1
+            first = int(first)
+
+        edges = self.edges
+        height, width = edges.shape[:2]
+        for i in range(magnitude):
+            x = x + step_x
+            y = y + step_y
+            if i < first:
+                continue
+            # Stop at the image border instead of wrapping around
+            if not (0 <= int(y) < height and 0 <= int(x) < width):
+                break
+            if edges[int(y), int(x)] >= self.threshold:
+                return [x, y, point[2]]
+
+        return -1
+
+
+# State of the processes of build_edge_volume, set by _init_edge_worker
+_edge_worker = dict()
+
+
+def _init_edge_worker(vol_path, options, spec, t1, t2, dilation, method,
+                      window):
+    _edge_worker["vol"] = Volume.from_path(vol_path, options=options)
+    _edge_worker["store"] = ts.open(spec).result()
+    _edge_worker["params"] = (t1, t2, dilation, method, window)
+
+
+def _compute_edge_slab(z0: int, z1: int) -> int:
+    vol = _edge_worker["vol"]
+    store = _edge_worker["store"]
+    t1, t2, dilation, method, window = _edge_worker["params"]
+    for z in range(z0, z1):
+        edges = EDGE_DETECTORS[method](vol[z], t1, t2, dilation=dilation,
+                                       window=window)
+        store[z].write(np.packbits(edges > 0, axis=-1)).result()
+    return z1 - z0
+
+
+def _merge_ranges(ranges):
+    merged = []
+    for z0, z1 in sorted(ranges):
+        if merged and z0 <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], z1)
+        else:
+            merged.append([z0, z1])
+    return merged
+
+
+def build_edge_volume(vol_path: Path, t1=100, t2=120, dilation=2,
+                      method='canny',
+                      z_range: Optional[Tuple[int, int]] = None,
+                      chunks: Tuple[int, int] = (1024, 128),
+                      num_processes: Optional[int] = None,
+                      options: Optional[VolumeOptions] = None,
+                      progress: bool = True) -> Path:
+    """
+    Precompute the edge maps of a volume, or of a range of its slices
+
+    Edge maps are computed across a process pool and stored bit-packed in a
+    chunked Zarr inside the volume directory, tagged with the parameters used
+    and the slices computed so far. Slices are normalized with the volume's
+    intensity window, like slice_edges does. Building another range with the
+    same parameters adds to the existing edges. slice_edges reads from it
+    whenever its parameters match.
+
+    :param vol_path: path to the volume
+    :param t1: lower threshold for the edge detection
+    :param t2: higher threshold for the edge detection
+    :param dilation: size of dilation kernel (size 1 means no dilation)
+    :param method: edge detector, one of EDGE_DETECTORS
+    :param z_range: (first, last + 1) slices to compute (default: all)
+    :param chunks: (height, packed width in bytes) chunk shape of each slice
+    :param num_processes: size of the process pool (default: number of CPUs)
+    :param options: how the processes open the volume
+    :param progress: whether to show a progress bar
+    """
+    if method not in EDGE_DETECTORS:
+        raise ValueError(f"Unknown edge detector: {method}")
+    if options is None:
+        options = VolumeOptions.from_env()
+    if num_processes is None:
+        num_processes = os.cpu_count() or 1
+
+    vol = Volume.from_path(vol_path, options=replace(options, lazy=True))
+    shape_z, shape_y, shape_x = vol.shape
+    window = list(vol.intensity_window())
+    # Slabs follow the volume's chunks, so each chunk is decoded only once
+    slab = vol.chunks[0]
+    z0, z1 = (0, shape_z) if z_range is None else z_range
+    z0, z1 = max(int(z0), 0), min(int(z1), shape_z)
+    if z0 >= z1:
+        raise ValueError(f"Empty slice range: {z_range}")
+
+    path = edge_volume_path(vol.path, t1, t2, dilation, method)
+    attrs_filename = path / ".zattrs"
+    shape = [shape_z, shape_y, -(-shape_x // 8)]
+    attrs = None
+    if attrs_filename.exists():
+        with open(attrs_filename) as f:
+            attrs = json.load(f)
+        if (attrs["shape"] != [shape_z, shape_y, shape_x] or
+                attrs.get("window") != window):
+            attrs = None
+
+    spec = {
+        "driver": "zarr",
+        "kvstore": {
+            "driver": "file",
+            "path": str(path),
+        },
+    }
+    if attrs is None:
+        # Readers only use the edges once the attributes list the slices
+        attrs_filename.unlink(missing_ok=True)
+        attrs = {
+            "method": method,
+            "threshold1": t1,
+            "threshold2": t2,
+            "dilation": dilation,
+            "window": window,
+            "shape": [shape_z, shape_y, shape_x],
+            "width": shape_x,
+            "slices": [],
+        }
+        ts.open({
+            **spec,
+            "metadata": {
+                "shape": shape,
+                "chunks": [1, min(chunks[0], shape[1]),
+                           min(chunks[1], shape[2])],
+                "dtype": "|u1",
+                "compressor": EDGE_VOLUME_COMPRESSOR,
+            },
+            "create": True,
+            "delete_existing": True,
+        }).result()
+
+    # Each process reads every slice once and keeps only its share of the
+    # chunk cache
+    worker_options = replace(
+        options, lazy=True, slice_cache_bytes=0,
+        cache_pool_bytes=options.cache_pool_bytes // num_processes)
+    slabs = [(max(s, z0), min(s + slab, z1))
+             for s in range(z0 - z0 % slab, z1, slab)]
+    # Spawned, since forking would copy tensorstore's threads state
+    with ProcessPoolExecutor(
+            max_workers=num_processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_edge_worker,
+            initargs=(str(vol.path), worker_options, spec, t1, t2, dilation,
+                      method, tuple(window))) as executor, \
+            tqdm(total=z1 - z0, disable=not progress) as bar:
+        for count in executor.map(_compute_edge_slab, *zip(*slabs)):
+            bar.update(count)
+
+    attrs["slices"] = _merge_ranges(attrs["slices"] + [[z0, z1]])
+    with open(attrs_filename, "w") as f:
+        json.dump(attrs, f, indent=2)
+    return path
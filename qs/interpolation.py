@@ -1,44 +1,72 @@
 from __future__ import annotations
 
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+
 import numpy as np
 from qs.math import (normalized_direction,
                     calculate_sq_distance,
                     get_vector_magnitude,
                     find_sobel_edge, inverse_vector, 
-                    perpendicular_vector, 
-                    canny_edge
+                    perpendicular_vector
                     )
+from qs.data import Volume
+from qs.data.cache import LRUCache
+from qs.data.segmentation import key_slice_index
+from qs.edges import (REGION_DETECTORS, EdgeDistanceMap, iter_slice_edges,
+                      region_edges, volume_key)
 from math import sqrt
 from matplotlib import pyplot as plt
 
+# Fewer interpolated slices than this are not worth starting processes for
+PARALLEL_MIN_SLICES = 256
+
+# Byte budget of the snapped contours kept for partial interpolation
+DEFAULT_CHAIN_CACHE_BYTES = 256 * 1024 ** 2
+
 def find_coordinate(start, end, current, coord):
     i = 1 if coord == 'y' else 0
     return (end[i] - start[i]) * (current - start[2]) / (end[2] - start[2]) + \
            start[i]
 
 
-def find_next_key(current, lines):
-    temp = lines.copy()
-    temp[current] = 1
-    slices = sorted(temp.keys())
+def find_next_key(current, lines, index=None):
+    """
+    Points of the first key slice after current, or -1 if there is none
 
-    pos = slices.index(current)
-    if pos >= (len(slices) - 1):
+    :param current: the number of the current slice
+    :param lines: the segmentation lines
+    :param index: key slice index of lines, built from plain dicts if none
+        is given (pass it when querying the same lines repeatedly)
+    """
+    if index is None:
+        index = key_slice_index(lines)
+    next_slice = index.next(current)
+    if next_slice is None:
         return -1
 
-    return temp[slices[pos + 1]]
+    return lines[next_slice]
 
 
-def find_previous_key(current, lines):
-    temp = lines.copy()
-    temp[current] = 1
-    slices = sorted(temp.keys())
+def find_previous_key(current, lines, index=None):
+    """
+    Points of the last key slice before current, or -1 if there is none
 
-    pos = slices.index(current)
-    if pos <= 0:
+    :param current: the number of the current slice
+    :param lines: the segmentation lines
+    :param index: key slice index of lines, built from plain dicts if none
+        is given (pass it when querying the same lines repeatedly)
+    """
+    if index is None:
+        index = key_slice_index(lines)
+    previous_slice = index.previous(current)
+    if previous_slice is None:
         return -1
 
-    return temp[slices[pos - 1]]
+    return lines[previous_slice]
 
 #--------------------------------------------------------------
 #               LINEAR INTERPOLATION FUNCTIONS
@@ -58,6 +86,23 @@ def interpolate_point(current, prev_key, next_key):
         current
     ]
 
+def interpolate_points(current, prev_key, next_key):
+    """
+    Returns the points of a slice, linearly interpolated between the points of
+    two slices, as an (N, 3) array. Same as interpolate_point for each point.
+
+    :param current: the number of the current slice
+    :param prev_key: points in the previous key slice
+    :param next_key: points in the next slice
+    """
+    start = np.asarray(prev_key, dtype='float64')
+    end = np.asarray(next_key, dtype='float64')
+
+    points = np.empty(start.shape, dtype='float64')
+    points[:, :2] = (end[:, :2] - start[:, :2]) * (current - start[:, 2:3]) / (end[:, 2:3] - start[:, 2:3]) + start[:, :2]
+    points[:, 2] = current
+    return points
+
 def partial_linear_interpolation(ax, lines, slice, img, circle_size=0):
     """
     Partially linearly interpolates a given slice between the two slices that
@@ -68,8 +113,10 @@ def partial_linear_interpolation(ax, lines, slice, img, circle_size=0):
     :param slice: slice where the interpolation is drawn
     :param circle_size: the circle that indicates if the line is active (0 if not, 7 if active)
     """
-    previous_key = find_previous_key(slice, lines)
-    next_key = find_next_key(slice, lines)
+    # One index for both lookups, plain dicts are only indexed once
+    index = key_slice_index(lines)
+    previous_key = find_previous_key(slice, lines, index)
+    next_key = find_next_key(slice, lines, index)
 
     point = interpolate_point(slice, previous_key[0], next_key[0])
     prev_point = point # Initialize it to the point, update later
@@ -97,7 +144,9 @@ def partial_linear_interpolation(ax, lines, slice, img, circle_size=0):
 
 def full_linear_interpolation(lines):
     """ 
-    Linearly interpolates the full extent of the segmentation
+    Linearly interpolates the full extent of the segmentation. The output has
+    a row for each slice after the first key slice up to the last one, with
+    key slices copied as they are.
 
     :param lines: an array of lines where each line is a list of points in a key slice
     """
@@ -106,40 +155,45 @@ def full_linear_interpolation(lines):
         print('add points to at least two separate slices')
         return
 
-    lines = dict(sorted(lines.items()))
+    keys = sorted(lines.keys())
+    first = keys[0]
+    last = keys[-1]
 
-    first = list(lines.keys())[0]
-    last = list(lines.keys())[-1]
+    # (K, N, 3) key slice points
+    key_points = np.array([lines[k] for k in keys], dtype='float64')
 
-    # empty point cloud to store final points
-    cloud = [[]]
+    # Previous and next key slice of every output slice
+    slices = np.arange(first + 1, last + 1)
+    next_idx = np.searchsorted(keys, slices)
+    start = key_points[next_idx - 1]
+    end = key_points[next_idx]
+    current = slices.astype('float64')[:, None]
 
-    # Set starting parameters
-    prev_key = lines[first]
-    next_key = find_next_key(first, lines)
-    for i, slice_idx in enumerate(range(first + 1, last)):
-        cloud.append([])
+    # Same operations as find_coordinate, broadcast over slices and points
+    cloud = np.empty((len(slices),) + key_points.shape[1:], dtype='float64')
+    cloud[..., 0] = (end[..., 0] - start[..., 0]) * (current - start[..., 2]) / (end[..., 2] - start[..., 2]) + start[..., 0]
+    cloud[..., 1] = (end[..., 1] - start[..., 1]) * (current - start[..., 2]) / (end[..., 2] - start[..., 2]) + start[..., 1]
+    cloud[..., 2] = current
 
-        # When we reach the 'next' key slice (a user defined non-interpolated slice), add it and update boundaries
-        if slice_idx == next_key[0][2]:
-            for point in lines[slice_idx]:
-                cloud[i].append(point)
-            next_key = find_next_key(slice_idx, lines)
-            prev_key = cloud[i]
-        else:
-            # If slice is not user defined, find it through interpolation
-            for point in range(len(prev_key)):
-                interpolated_point = interpolate_point(slice_idx,
-                                                       prev_key[point],
-                                                       next_key[point])
-                cloud[i].append(interpolated_point)
+    # Key slices are kept as they are
+    cloud[np.array(keys[1:]) - first - 1] = key_points[1:]
 
-    # Conclude interpolation by adding last slice
-    for point in lines[last]:
-        cloud[-1].append(point)
+    return cloud
 
-    return np.array(cloud, dtype='float64')
+def iter_full_linear_interpolation(lines):
+    """
+    Yields the rows of full_linear_interpolation one slice at a time, so only
+    one row is held in memory
 
+    :param lines: an array of lines where each line is a list of points in a key slice
+    """
+    keys = sorted(lines.keys())
+    for prev_slice, next_slice in zip(keys[:-1], keys[1:]):
+        prev_key = np.asarray(lines[prev_slice], dtype='float64')
+        next_key = np.asarray(lines[next_slice], dtype='float64')
+        for slice_idx in range(prev_slice + 1, next_slice):
+            yield interpolate_points(slice_idx, prev_key, next_key)
+        yield next_key
 
 
 #--------------------------------------------------------------
@@ -169,6 +223,9 @@ def find_normal_direction(point, n1, n2):
 
 
 def detect_edge_along_line(edge_data, point, direction, magnitude=40):
+    if isinstance(edge_data, EdgeDistanceMap):
+        return edge_data.detect_edge_along_line(point, direction, magnitude)
+
     vec_size = get_vector_magnitude(direction)
     scaled_direction = [(direction[0])/vec_size, (direction[1])/vec_size, 0]
     x = point[0]
@@ -180,6 +237,9 @@ def detect_edge_along_line(edge_data, point, direction, magnitude=40):
     for i in range(magnitude):
         x = x + scaled_direction[0]
         y = y + scaled_direction[1]
+        # Stop at the image border instead of wrapping around
+        if not (0 <= int(y) < len(edge_data) and 0 <= int(x) < len(edge_data[0])):
+            break
         if (edge_data[int(y)][int(x)] >= 10):
             return [x, y, point[2]]
 
@@ -200,6 +260,120 @@ def adjust_point_based_on_edges(edge_data, point, neighbor_1, neighbor_2=None, m
 
     return midpoint
 
+def normalized_directions(points, orig, magnitude=1):
+    """
+    Batched normalized_direction: directions from orig to points scaled to
+    magnitude, or 0 where points and orig are the same
+
+    :param points: (N, 3) points that define the vectors
+    :param orig: (N, 3) or (3,) points the vectors start from
+    :param magnitude: size to be normalized to
+    """
+    diff = points - orig
+    dist = np.sqrt((diff[:, 0] ** 2 + diff[:, 1] ** 2) + diff[:, 2] ** 2)[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        directions = magnitude * (diff / dist)
+    directions[dist[:, 0] == 0] = 0
+    return directions
+
+def find_normal_directions(points, n1, n2):
+    """
+    Batched find_normal_direction: normals of points based on their neighbors
+
+    :param points: (N, 3) points which you want the normal of
+    :param n1: (N, 3) neighboring points
+    :param n2: (N, 3) other neighboring points
+    """
+    n1 = normalized_directions(n1, points, 20)
+    n2 = normalized_directions(n2, points, 20)
+    direction = n1 + n2
+
+    # Opposite neighbors: use the perpendicular of the first one, computed like
+    # perpendicular_vector
+    opposite = (direction == 0).all(axis=1)
+    direction[opposite, 0] = n1[opposite, 1] * 1.0 - n1[opposite, 2] * 0.0
+    direction[opposite, 1] = n1[opposite, 2] * 0.0 - n1[opposite, 0] * 1.0
+    direction[opposite, 2] = n1[opposite, 2]
+
+    return normalized_directions(direction, 0, magnitude=40)
+
+def detect_edges_along_lines(edge_data, points, directions, magnitude=40, threshold=10):
+    """
+    Batched detect_edge_along_line: walks every ray in one vectorized gather.
+    Returns the (N, 3) edge positions and an (N,) mask of the rays that found
+    an edge.
+
+    :param edge_data: edge map
+    :param points: (N, 3) starting points
+    :param directions: (N, 3) search directions
+    :param magnitude: number of unit steps to take along each ray
+    :param threshold: smallest value of an edge pixel
+    """
+    vec_size = np.sqrt((directions[:, 0] ** 2 + directions[:, 1] ** 2) + directions[:, 2] ** 2)
+    valid_direction = vec_size != 0
+
+    # Cumulative sums add the steps one at a time like the scalar walk
+    steps = np.empty((2, len(points), magnitude + 1), dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        steps[:, :, 1:] = (directions[:, :2] / vec_size[:, None]).T[:, :, None]
+    steps[:, :, 0] = points[:, :2].T
+    x, y = np.cumsum(steps, axis=2)[:, :, 1:]
+
+    # Stop at the image border instead of wrapping around
+    height, width = edge_data.shape[:2]
+    with np.errstate(invalid='ignore'):
+        ix = np.trunc(x)
+        iy = np.trunc(y)
+        inside = (0 <= iy) & (iy < height) & (0 <= ix) & (ix < width)
+    inside = np.logical_and.accumulate(inside, axis=1) & valid_direction[:, None]
+    ix = np.where(inside, ix, 0).astype(np.intp)
+    iy = np.where(inside, iy, 0).astype(np.intp)
+    hits = inside & (edge_data[iy, ix] >= threshold)
+
+    found = hits.any(axis=1)
+    first = hits.argmax(axis=1)
+    rows = np.arange(len(points))
+    edges = np.empty((len(points), 3), dtype='float64')
+    edges[:, 0] = x[rows, first]
+    edges[:, 1] = y[rows, first]
+    edges[:, 2] = points[:, 2]
+    return edges, found
+
+def snap_points(edge_data, points, magnitude=40, threshold=10):
+    """
+    Batched adjust_point_based_on_edges for all the points of a contour: each
+    point moves to the middle of the edges found on both sides along its
+    normal, and stays in place if either edge is not found. Neighbors are the
+    other points of the contour, with the first and last point mirroring
+    their only neighbor.
+
+    :param edge_data: edge map of the slice
+    :param points: (N, 3) points of the contour, N >= 2
+    :param magnitude: maximum distance away from point to look for edge
+    :param threshold: smallest value of an edge pixel
+    """
+    points = np.asarray(points, dtype='float64')
+
+    # Neighbors, mirrored at the ends like inverse_vector
+    n1 = np.empty_like(points)
+    n1[0] = points[1]
+    n1[1:] = points[:-1]
+    n2 = np.empty_like(points)
+    n2[1:-1] = points[2:]
+    for end, other in ((0, 1), (-1, -2)):
+        n2[end, :2] = points[end, :2] + (points[end, :2] - points[other, :2])
+        n2[end, 2] = points[other, 2]
+
+    normals = find_normal_directions(points, n1, n2)
+    inverse_normals = np.stack([0 + (0 - normals[:, 0]), 0 + (0 - normals[:, 1]), normals[:, 2]], axis=1)
+    edge_1, found_1 = detect_edges_along_lines(edge_data, points, normals, magnitude, threshold)
+    edge_2, found_2 = detect_edges_along_lines(edge_data, points, inverse_normals, magnitude, threshold)
+
+    adjusted = points.copy()
+    found = found_1 & found_2
+    adjusted[found, :2] = (edge_1[found, :2] + edge_2[found, :2]) / 2
+    return adjusted
+
 def draw_detected_edge(ax, edge_data, point, neighbor_1, neighbor_2=None, magnitude=40):
     if (neighbor_2 == None):
         neighbor_2 = inverse_vector(neighbor_1, point)
@@ -220,140 +394,288 @@ def draw_detected_edge(ax, edge_data, point, neighbor_1, neighbor_2=None, magnit
         ax.plot([point[0], edge_2[0]],
                     [point[1], edge_2[1]], color='magenta')
 
-def partial_nonlinear_interpolation(ax, lines, slice, vol, draw_edges=True, edge_threshold1=100, edge_threshold2=120, edge_search_limit=40, circle_size=0):
+def contour_edges(vol, z, points, edge_threshold1=100, edge_threshold2=120, edge_search_limit=40, edge_method='canny'):
     """
-    Partially interpolates a given slice between the two slices that
-    surround it based on edges.
+    Gets the edges of a slice around a contour, as far as the edge search
+    can reach from its points
 
-    :param ax: the ax on which to draw interpolation
-    :param lines: the segmentation lines
-    :param slice: slice where the interpolation is drawn
     :param vol: images of the slices used to calculate edges
-    :param circle_size: the circle that indicates if the line is active (0 if not, 7 if active)
+    :param z: slice the edges are computed on
+    :param points: (interpolated) points of the contour
+    :param edge_search_limit: maximum distance away from point to look for edge
+    :param edge_method: edge detector used to find edges ('canny' or 'sobel')
     """
-    previous_key = find_previous_key(slice, lines)
-    next_key = find_next_key(slice, lines)
-    relative_key = [i for i in previous_key]
-    next_relative_key = []
+    xy = np.asarray(points, dtype='float64')[:, :2]
+    radius = edge_search_limit + 1
+    x0, y0 = np.floor(xy.min(axis=0)).astype(int) - radius
+    x1, y1 = np.ceil(xy.max(axis=0)).astype(int) + radius + 1
 
-    initial_slice = previous_key[0][2] + 1
+    return region_edges(vol, z, (y0, y1), (x0, x1), edge_threshold1, edge_threshold2, dilation=2, method=edge_method)
 
-    for i in range(initial_slice, slice):
-        next_relative_key.clear()
-        # For each intermediate slice between the previous and current
-        # Get edge information
-        edge_data = canny_edge(vol[slice], edge_threshold1, edge_threshold2, dilation=2)
-        # Find first two points
-        point = interpolate_point(i, relative_key[0], next_key[0])
-        next_point = interpolate_point(i, relative_key[1], next_key[1])
-
-        # Adjust first point
-        next_relative_key.append(adjust_point_based_on_edges(edge_data, point=point, neighbor_1=next_point, magnitude=edge_search_limit))
-
-        # Iterate between the 2nd and penultimate point
-        for j in range(1, len(relative_key) - 1):
-            prev_point = point
-            point = next_point
-            next_point = interpolate_point(i, relative_key[j + 1], next_key[j + 1])
-
-            next_relative_key.append(adjust_point_based_on_edges(edge_data, point=point, neighbor_1=prev_point, neighbor_2=next_point, magnitude=edge_search_limit))
-
-        # Adjust last point
-        next_relative_key.append(adjust_point_based_on_edges(edge_data, point=next_point, neighbor_1=point, magnitude=edge_search_limit))
-        relative_key.clear()
-        relative_key = [p for p in next_relative_key]
-    
-    # For last slice, repeat above process on last time, but this time draw it to canvas
-    edge_data = canny_edge(vol[slice], edge_threshold1, edge_threshold2, dilation=2)
-    point = interpolate_point(slice, relative_key[0], next_key[0])
-    next_point = interpolate_point(slice, relative_key[1], next_key[1])
-    adjusted_point = adjust_point_based_on_edges(edge_data, point=point, neighbor_1=next_point, magnitude=edge_search_limit)
-    if draw_edges: draw_detected_edge(ax, edge_data, point=point, neighbor_1=next_point, magnitude=edge_search_limit)
-    ax.add_artist(
-        plt.Circle((adjusted_point[0], adjusted_point[1]), 3.5, color='yellow'))
+class IntervalChain:
+    """
+    Snapped contours of the slices between two key slices
 
-    for j in range(1, len(relative_key) - 1):
-        prev_point = point
-        point = next_point
-        next_point = interpolate_point(slice, relative_key[j + 1], next_key[j + 1])
-        adjusted_point = adjust_point_based_on_edges(edge_data, point=point, neighbor_1=prev_point, neighbor_2=next_point, magnitude=edge_search_limit)
-        if draw_edges: draw_detected_edge(ax, edge_data, point=point, neighbor_1=prev_point, neighbor_2=next_point, magnitude=edge_search_limit)
-        ax.add_artist(
-            plt.Circle((adjusted_point[0], adjusted_point[1]), 3.5, color='yellow'))
-    
-    adjusted_point = adjust_point_based_on_edges(edge_data, point=next_point, neighbor_1=point, magnitude=edge_search_limit)
-    if draw_edges: draw_detected_edge(ax, edge_data, point=next_point, neighbor_1=point, magnitude=edge_search_limit)
-    ax.add_artist(
-        plt.Circle((adjusted_point[0], adjusted_point[1]), 3.5, color='yellow'))
+    Every slice is snapped starting from the contour of the slice before it,
+    so contours are computed in order, only as far as they are asked for,
+    and kept for the next time.
+    """
 
-def full_nonlinear_interpolation(lines, vol, edge_threshold1=100, edge_threshold2=120, edge_search_limit=40):
+    def __init__(self, vol, prev_key, next_key, edge_threshold1=100, edge_threshold2=120, edge_search_limit=40, edge_method='canny'):
+        """
+        :param vol: images of the slices used to calculate edges
+        :param prev_key: points in the previous key slice
+        :param next_key: points in the next key slice
+        :param edge_search_limit: maximum distance away from point to look for edge
+        :param edge_method: edge detector used to find edges ('canny' or 'sobel')
+        """
+        self.vol = vol
+        self.prev_key = np.asarray(prev_key, dtype='float64')
+        self.next_key = np.asarray(next_key, dtype='float64')
+        self.first = int(self.prev_key[0][2])
+        self.params = (edge_threshold1, edge_threshold2, edge_search_limit, edge_method)
+        last = int(self.next_key[0][2])
+        self.contours = np.empty((last - self.first - 1, len(self.prev_key), 3), dtype='float64')
+        self.computed = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.contours.nbytes
+
+    def __getitem__(self, slice_idx):
+        """
+        Contour of a slice of the interval, or the previous key slice
+
+        :param slice_idx: slice number
+        """
+        i = slice_idx - self.first
+        if not 0 <= i <= len(self.contours):
+            raise IndexError(f"Slice {slice_idx} is not between the key slices")
+        if i == 0:
+            return self.prev_key
+
+        edge_threshold1, edge_threshold2, edge_search_limit, edge_method = self.params
+        while self.computed < i:
+            current = self.first + self.computed + 1
+            interpolated = interpolate_points(current, self[current - 1], self.next_key)
+            edge_data = contour_edges(self.vol, current, interpolated, edge_threshold1, edge_threshold2, edge_search_limit, edge_method)
+            self.contours[self.computed] = snap_points(edge_data, interpolated, magnitude=edge_search_limit)
+            self.computed += 1
+        return self.contours[i - 1]
+
+# Interval chains of the segmentations being viewed. Chains are keyed by the
+# contents of their key slices, so editing a key slice or changing the
+# parameters starts a new chain and the old one ages out.
+interval_chains = LRUCache(DEFAULT_CHAIN_CACHE_BYTES)
+
+def interval_chain(vol, prev_key, next_key, edge_threshold1=100, edge_threshold2=120, edge_search_limit=40, edge_method='canny'):
     """
-    Fully interpolates a given slice between the two slices that
-    surround it based on edges.
+    Gets the cached IntervalChain between two key slices, or starts one
+
+    :param vol: images of the slices used to calculate edges
+    :param prev_key: points in the previous key slice
+    :param next_key: points in the next key slice
+    :param edge_search_limit: maximum distance away from point to look for edge
+    :param edge_method: edge detector used to find edges ('canny' or 'sobel')
+    """
+    prev_points = np.asarray(prev_key, dtype='float64')
+    next_points = np.asarray(next_key, dtype='float64')
+    key = (volume_key(vol), edge_threshold1, edge_threshold2, edge_search_limit, edge_method,
+           prev_points.shape, prev_points.tobytes(), next_points.shape, next_points.tobytes())
+
+    chain = interval_chains.get(key)
+    if chain is None:
+        chain = IntervalChain(vol, prev_points, next_points, edge_threshold1, edge_threshold2, edge_search_limit, edge_method)
+        interval_chains.put(key, chain)
+    return chain
+
+def partial_nonlinear_interpolation(ax, lines, slice, vol, draw_edges=True, edge_threshold1=100, edge_threshold2=120, edge_search_limit=40, circle_size=0, edge_method='canny'):
+    """
+    Partially interpolates a given slice between the two slices that
+    surround it based on edges. The slices before it are snapped once per
+    interval and parameters, and reused while scrolling.
 
+    :param ax: the ax on which to draw interpolation
     :param lines: the segmentation lines
+    :param slice: slice where the interpolation is drawn
     :param vol: images of the slices used to calculate edges
+    :param circle_size: the circle that indicates if the line is active (0 if not, 7 if active)
+    :param edge_method: edge detector used to find edges ('canny' or 'sobel')
     """
+    # One index for both lookups, plain dicts are only indexed once
+    index = key_slice_index(lines)
+    previous_key = find_previous_key(slice, lines, index)
+    next_key = find_next_key(slice, lines, index)
+
+    chain = interval_chain(vol, previous_key, next_key, edge_threshold1, edge_threshold2, edge_search_limit, edge_method)
+    adjusted = chain[slice]
+
+    if draw_edges:
+        # Redo the edge search of the last slice to draw it
+        points = interpolate_points(slice, chain[slice - 1], next_key).tolist()
+        edge_data = contour_edges(vol, slice, points, edge_threshold1, edge_threshold2, edge_search_limit, edge_method)
+        # The rays are walked one at a time, most of them skip to where an
+        # edge is within reach or are rejected outright
+        edge_data = EdgeDistanceMap.around(edge_data, points, edge_search_limit + 1 + 2 * sqrt(2))
+        draw_detected_edge(ax, edge_data, point=points[0], neighbor_1=points[1], magnitude=edge_search_limit)
+        for j in range(1, len(points) - 1):
+            draw_detected_edge(ax, edge_data, point=points[j], neighbor_1=points[j - 1], neighbor_2=points[j + 1], magnitude=edge_search_limit)
+        draw_detected_edge(ax, edge_data, point=points[-1], neighbor_1=points[-2], magnitude=edge_search_limit)
+
+    for adjusted_point in adjusted:
+        ax.add_artist(
+            plt.Circle((adjusted_point[0], adjusted_point[1]), 3.5, color='yellow'))
 
-    if len(lines) <= 1:
-        print('add points to at least two separate slices')
-        return
-    
-    lines = dict(sorted(lines.items()))
+def nonlinear_interpolate_slice(edge_data, relative_key, next_key, current, edge_search_limit=40):
+    """
+    Interpolates a slice between the contour of the slice before it and the
+    next key slice, then adjusts every point based on edges
 
-    first = list(lines.keys())[0]
-    last = list(lines.keys())[-1]
+    :param edge_data: edge map of the current slice
+    :param relative_key: (adjusted) points of the slice before the current one
+    :param next_key: points of the next key slice
+    :param current: the number of the current slice
+    :param edge_search_limit: maximum distance away from point to look for edge
+    """
+    interpolated = interpolate_points(current, relative_key, next_key)
+    return snap_points(edge_data, interpolated, magnitude=edge_search_limit)
 
-    # empty point cloud to store final points
-    cloud = []
+def iter_nonlinear_interval(vol, prev_key, next_key, edge_threshold1=100, edge_threshold2=120, edge_search_limit=40, edge_method='canny'):
+    """
+    Interpolates the slices between two consecutive key slices, adjusting
+    each slice based on edges, starting from the previous key slice. Yields
+    the contour of each slice in between.
 
-    prev_key = lines[first]
-    next_key = find_next_key(first, lines)
-    relative_key = [i for i in prev_key]
-    next_relative_key = []
+    :param vol: images of the slices used to calculate edges
+    :param prev_key: points in the previous key slice
+    :param next_key: points in the next key slice
+    :param edge_search_limit: maximum distance away from point to look for edge
+    :param edge_method: edge detector used to find edges ('canny' or 'sobel')
+    """
+    slices = range(int(prev_key[0][2]) + 1, int(next_key[0][2]))
 
-    for i, slice_idx in enumerate(range(first, last)):
+    # Edges are computed only around each interpolated contour when the
+    # detector allows it, otherwise whole slices are read concurrently
+    edges = None
+    if edge_method not in REGION_DETECTORS:
+        edges = iter_slice_edges(vol, slices, edge_threshold1, edge_threshold2, dilation=2, method=edge_method)
 
-        if slice_idx == next_key[0][2]:
-            for point in lines[slice_idx]:
-                cloud[i].append(point)
-            next_key = find_next_key(slice_idx, lines)
-            relative_key = cloud[i]
+    relative_key = prev_key
+    for slice_idx in slices:
+        # Get edge information
+        if edges is None:
+            interpolated = interpolate_points(slice_idx, relative_key, next_key)
+            edge_data = contour_edges(vol, slice_idx, interpolated, edge_threshold1, edge_threshold2, edge_search_limit, edge_method)
         else:
-            next_relative_key.clear()
-            # For each intermediate slice between the previous and current
-            # Get edge information
-            edge_data = canny_edge(vol[slice_idx], edge_threshold1, edge_threshold2, dilation=2)
-            # Find first two points
-            point = interpolate_point(i, relative_key[0], next_key[0])
-            next_point = interpolate_point(i, relative_key[1], next_key[1])
+            edge_data = next(edges)
+        relative_key = nonlinear_interpolate_slice(edge_data, relative_key, next_key, slice_idx, edge_search_limit)
+        yield relative_key
 
-            # Adjust first point
-            next_relative_key.append(adjust_point_based_on_edges(edge_data, point=point, neighbor_1=next_point, magnitude=edge_search_limit))
+def nonlinear_interpolate_interval(vol, prev_key, next_key, edge_threshold1=100, edge_threshold2=120, edge_search_limit=40, edge_method='canny'):
+    """
+    Same as iter_nonlinear_interval, returning an array with the contours of
+    the slices in between
+    """
+    slices = int(next_key[0][2]) - int(prev_key[0][2]) - 1
+    contours = np.empty((slices, len(prev_key), 3), dtype='float64')
+    for i, contour in enumerate(iter_nonlinear_interval(vol, prev_key, next_key, edge_threshold1, edge_threshold2, edge_search_limit, edge_method)):
+        contours[i] = contour
+    return contours
+
+# State of the processes of full_nonlinear_interpolation, set by
+# _init_interpolation_worker
+_interpolation_worker = dict()
+
+def _init_interpolation_worker(vol_path, options, window, edge_threshold1, edge_threshold2, edge_search_limit, edge_method):
+    _interpolation_worker["vol"] = Volume.from_path(vol_path, options=options)
+    # Same window as this process, instead of sampling slices again
+    _interpolation_worker["vol"].set_intensity_window(window)
+    _interpolation_worker["params"] = (edge_threshold1, edge_threshold2, edge_search_limit, edge_method)
+
+def _interpolate_interval(prev_key, next_key):
+    return nonlinear_interpolate_interval(_interpolation_worker["vol"], prev_key, next_key, *_interpolation_worker["params"])
+
+def iter_full_nonlinear_interpolation(lines, vol, edge_threshold1=100, edge_threshold2=120, edge_search_limit=40, edge_method='canny', num_processes=1):
+    """
+    Yields the rows of full_nonlinear_interpolation one slice at a time
 
-            # Iterate between the 2nd and penultimate point
-            for j in range(1, len(relative_key) - 1):
-                prev_point = point
-                point = next_point
-                next_point = interpolate_point(i, relative_key[j + 1], next_key[j + 1])
+    Every interval between key slices is interpolated on its own, so the
+    intervals can be spread across a process pool. The processes open the
+    volume from its path and share its intensity window; the slices of a
+    single interval are always interpolated in order. Only one row is held
+    in memory when interpolating in this process, and a few intervals when
+    using processes.
 
-                next_relative_key.append(adjust_point_based_on_edges(edge_data, point=point, neighbor_1=prev_point, neighbor_2=next_point, magnitude=edge_search_limit))
+    :param lines: the segmentation lines
+    :param vol: images of the slices used to calculate edges
+    :param edge_method: edge detector used to find edges ('canny' or 'sobel')
+    :param num_processes: number of processes interpolating intervals (None
+        for the number of CPUs, 1 to interpolate in this process)
+    """
+    keys = sorted(lines.keys())
+    intervals = list(zip(keys[:-1], keys[1:]))
+
+    if num_processes is None:
+        num_processes = os.cpu_count() or 1
+    num_processes = min(num_processes, len(intervals))
+    # Processes open the volume again, which needs it on disk
+    if (num_processes <= 1 or not isinstance(vol, Volume) or
+            keys[-1] - keys[0] - len(intervals) < PARALLEL_MIN_SLICES):
+        for prev_slice, next_slice in intervals:
+            yield from iter_nonlinear_interval(vol, lines[prev_slice], lines[next_slice], edge_threshold1, edge_threshold2, edge_search_limit, edge_method)
+            yield np.asarray(lines[next_slice], dtype='float64')
+        return
 
-            # Adjust last point
-            next_relative_key.append(adjust_point_based_on_edges(edge_data, point=next_point, neighbor_1=point, magnitude=edge_search_limit))
-            relative_key.clear()
-            relative_key = [p for p in next_relative_key]
-            cloud.append([p for p in next_relative_key])
+    # Each process keeps only its share of the chunk cache
+    options = replace(vol.options, lazy=True, slice_cache_bytes=0,
+                      cache_pool_bytes=vol.options.cache_pool_bytes // num_processes)
+    # Spawned, since forking would copy tensorstore's threads state
+    with ProcessPoolExecutor(
+            max_workers=num_processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_interpolation_worker,
+            initargs=(str(vol.path), options, vol.intensity_window(),
+                      edge_threshold1, edge_threshold2, edge_search_limit,
+                      edge_method)) as executor:
+        # Intervals are yielded in order, with at most two per process
+        # in flight to bound memory
+        pending = deque()
+        for prev_slice, next_slice in intervals:
+            if len(pending) >= 2 * num_processes:
+                yield from _interval_rows(lines, *pending.popleft())
+            future = executor.submit(_interpolate_interval, lines[prev_slice], lines[next_slice])
+            pending.append((future, next_slice))
+        while pending:
+            yield from _interval_rows(lines, *pending.popleft())
+
+def _interval_rows(lines, future, next_slice):
+    yield from future.result()
+    yield np.asarray(lines[next_slice], dtype='float64')
+
+def full_nonlinear_interpolation(lines, vol, edge_threshold1=100, edge_threshold2=120, edge_search_limit=40, edge_method='canny', num_processes=1):
+    """
+    Fully interpolates the segmentation, adjusting every interpolated slice
+    based on edges. The output has the same layout as full_linear_interpolation.
+    See iter_full_nonlinear_interpolation.
 
-        print(next_relative_key)
-        print(cloud[-1])
+    :param lines: the segmentation lines
+    :param vol: images of the slices used to calculate edges
+    :param edge_method: edge detector used to find edges ('canny' or 'sobel')
+    :param num_processes: number of processes interpolating intervals (None
+        for the number of CPUs, 1 to interpolate in this process)
+    """
 
-    # Conclude interpolation by adding last slice
-    cloud.append([])
-    for point in lines[last]:
-        cloud[-1].append(point)
+    if len(lines) <= 1:
+        print('add points to at least two separate slices')
+        return
 
-    return np.array(cloud, dtype='float64')
+    keys = sorted(lines.keys())
+    cloud = np.empty((keys[-1] - keys[0], len(lines[keys[0]]), 3), dtype='float64')
+    rows = iter_full_nonlinear_interpolation(lines, vol, edge_threshold1, edge_threshold2, edge_search_limit, edge_method, num_processes)
+    for i, row in enumerate(rows):
+        cloud[i] = row
+
+    return cloud
 
 
 #--------------------------------------------------------------
@@ -368,13 +690,12 @@ def verify_partial_interpolation(current, lines):
     :param current: the number of the current slice
     :param lines: an array of lines where each line is a list of points in a key slice
     """
-    prev_key = find_previous_key(current, lines)
-    next_key = find_next_key(current, lines)
+    previous_slice, next_slice = key_slice_index(lines).bracket(current)
 
-    if prev_key == -1 or next_key == -1:
+    if previous_slice is None or next_slice is None:
         return False
 
-    if len(prev_key) != len(next_key):
+    if len(lines[previous_slice]) != len(lines[next_slice]):
         return False
 
     return True
@@ -396,7 +717,7 @@ def verify_full_interpolation(lines):
     return True
 
 # INTERPOLATION FUNCTIONS -------------------------------------
-def partial_interpolation(ax, lines, slice, type='linear', vol=None, draw_edges=True, edge_threshold1=100, edge_threshold2=120, edge_search_limit=40, circle_size=0):
+def partial_interpolation(ax, lines, slice, type='linear', vol=None, draw_edges=True, edge_threshold1=100, edge_threshold2=120, edge_search_limit=40, circle_size=0, edge_method='canny'):
     """
     Interpolates all points in a line between two slices
     
@@ -405,10 +726,11 @@ def partial_interpolation(ax, lines, slice, type='linear', vol=None, draw_edges=
     :param type: the type of interpolation to be carried out (linear or non-linear)
     :param vol: images of the slices used to calculate edges
     :param draw_edges: where or not to draw the normals the make up the edge detection
-    :param edge_threshold1: lower threshold for the canny edge detection
-    :param edge_threshold2: higher threshold for the canny edge detection
+    :param edge_threshold1: lower threshold for the edge detection
+    :param edge_threshold2: higher threshold for the edge detection
     :param edge_search_limit: maximum distance away from point to look for edge
     :param circle_size: the circle that indicates if the line is active (0 if not, 7 if active)
+    :param edge_method: edge detector used to find edges ('canny' or 'sobel')
     """
 
     if type == 'linear':
@@ -419,25 +741,51 @@ def partial_interpolation(ax, lines, slice, type='linear', vol=None, draw_edges=
                                         edge_threshold1=edge_threshold1, 
                                         edge_threshold2=edge_threshold2, 
                                         edge_search_limit=edge_search_limit, 
-                                        circle_size=circle_size)
+                                        circle_size=circle_size,
+                                        edge_method=edge_method)
     else:
         print("Not accepted interpolation type")
 
-def full_interpolation(lines, type='linear', vol=None, edge_threshold1=100, edge_threshold2=120, edge_search_limit=40):
+def full_interpolation(lines, type='linear', vol=None, edge_threshold1=100, edge_threshold2=120, edge_search_limit=40, edge_method='canny', num_processes=1):
     """
     Interpolates all points in a segmentation
     
     :param lines: the segmentation lines
     :param type: the type of interpolation to be carried out (linear or non-linear)
     :param vol: images of the slices used to calculate edges
-    :param edge_threshold1: lower threshold for the canny edge detection
-    :param edge_threshold2: higher threshold for the canny edge detection
+    :param edge_threshold1: lower threshold for the edge detection
+    :param edge_threshold2: higher threshold for the edge detection
     :param edge_search_limit: maximum distance away from point to look for edge
+    :param edge_method: edge detector used to find edges ('canny' or 'sobel')
+    :param num_processes: number of processes for non-linear interpolation
+        (None for the number of CPUs)
     """
 
     if type == 'linear':
         return full_linear_interpolation(lines)
     elif type == 'non-linear' and vol != None:
-        return full_nonlinear_interpolation(lines, vol, edge_threshold1=edge_threshold1, edge_threshold2=edge_threshold2, edge_search_limit=edge_search_limit)
+        return full_nonlinear_interpolation(lines, vol, edge_threshold1=edge_threshold1, edge_threshold2=edge_threshold2, edge_search_limit=edge_search_limit, edge_method=edge_method, num_processes=num_processes)
+    else:
+        print("Not accepted interpolation type")
+
+def iter_full_interpolation(lines, type='linear', vol=None, edge_threshold1=100, edge_threshold2=120, edge_search_limit=40, edge_method='canny', num_processes=1):
+    """
+    Yields the rows of full_interpolation one slice at a time, from the slice
+    after the first key slice to the last key slice
+
+    :param lines: the segmentation lines
+    :param type: the type of interpolation to be carried out (linear or non-linear)
+    :param vol: images of the slices used to calculate edges
+    :param edge_threshold1: lower threshold for the edge detection
+    :param edge_threshold2: higher threshold for the edge detection
+    :param edge_search_limit: maximum distance away from point to look for edge
+    :param edge_method: edge detector used to find edges ('canny' or 'sobel')
+    :param num_processes: number of processes for non-linear interpolation
+        (None for the number of CPUs)
+    """
+    if type == 'linear':
+        return iter_full_linear_interpolation(lines)
+    elif type == 'non-linear' and vol is not None:
+        return iter_full_nonlinear_interpolation(lines, vol, edge_threshold1=edge_threshold1, edge_threshold2=edge_threshold2, edge_search_limit=edge_search_limit, edge_method=edge_method, num_processes=num_processes)
     else:
-        print("Not accepted interpolation type")
\ No newline at end of file
+        raise ValueError(f"Not accepted interpolation type: {type}")
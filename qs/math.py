@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from functools import lru_cache
 from math import sqrt
 import numpy as np
 import cv2 as cv
@@ -63,36 +64,58 @@ def normalized_direction(point, orig = [0,0,0], magnitude = 1):
 
     return [x,y,z]
 
+# 5x5 Sobel-like kernels, applied as correlations on (y, x) images
+VERTICAL_EDGE_FILTER = np.array([[2, 1, 0, -1, -2],
+                                 [2, 1, 0, -1, -2],
+                                 [4, 2, 0, -2, -4],
+                                 [2, 1, 0, -1, -2],
+                                 [2, 1, 0, -1, -2]], dtype=np.float64)
+
+HORIZONTAL_EDGE_FILTER = np.array([[-2, -2, -4, -2, -2],
+                                   [-1, -1, -2, -1, -1],
+                                   [ 0,  0,  0,  0,  0],
+                                   [ 1,  1,  2,  1,  1],
+                                   [ 2,  2,  4,  2,  2]], dtype=np.float64)
+
+# Largest response of the edge filters on a 0-255 image: a full contrast step
+# (255 under the positive weights, 0 under the negative ones)
+SOBEL_MAX_RESPONSE = 255 * VERTICAL_EDGE_FILTER.clip(min=0).sum()
+
 def find_sobel_edge(img, point):
     """
-    Given an image and a coordinate within it, use edge-detection kernels to return the edge value
+    Given an image and coordinates within it, use edge-detection kernels to return the edge values,
+    the gradient magnitude of the two kernels like sobel_edge
     
     :param img: source image, accessed as (y, x)
-    :param point: coordinate we want to determine if is edge
+    :param point: coordinate (x, y) we want to determine if is edge, or an (N, 2) array of them
     """
+    points = np.asarray(point)
+    single = points.ndim == 1
+    points = np.atleast_2d(points)[:, :2].astype(np.int64)
 
-    vertical_edge_filter = [[2, 1, 0, -1, -2],
-                            [2, 1, 0, -1, -2],
-                            [4, 2, 0, -2, -4],
-                            [2, 1, 0, -1, -2],
-                            [2, 1, 0, -1, -2]]
+    # Gather the 5x5 window around every point, pixels outside the image count as 0
+    offsets = np.arange(-2, 3)
+    ys = points[:, 1, None, None] + offsets[None, :, None]
+    xs = points[:, 0, None, None] + offsets[None, None, :]
+    inside = (ys >= 0) & (ys < img.shape[0]) & (xs >= 0) & (xs < img.shape[1])
+    windows = np.where(inside, img[np.clip(ys, 0, img.shape[0] - 1), np.clip(xs, 0, img.shape[1] - 1)], 0)
 
-    horizontal_edge_filter = [[-2, -2, -4, -2, -2],
-                              [-1, -1, -2, -1, -1],
-                              [ 0,  0,  0,  0,  0],
-                              [ 1,  1,  2,  1,  1],
-                              [ 2,  2,  4,  2,  2]]
+    v_edge = (windows * VERTICAL_EDGE_FILTER).sum(axis=(1, 2))
+    h_edge = (windows * HORIZONTAL_EDGE_FILTER).sum(axis=(1, 2))
+    edges = np.hypot(v_edge, h_edge)
 
-    v_edge = 0
-    h_edge = 0
-    
-    for i in range(-2, 2):
-        for j in range(-2, 2):
-            pixel = img[point[1] + i, point[0] + j]
-            v_edge += pixel * vertical_edge_filter[i + 2][j + 2]
-            h_edge += pixel * horizontal_edge_filter[i + 2][j + 2]
+    return edges[0] if single else edges
 
-    return max(v_edge, h_edge)
+def sobel_edge_response(image):
+    """
+    Computes the edge value of find_sobel_edge for every pixel of an image in one pass
+    
+    :param image: image to be used
+    """
+    img = np.asarray(image, dtype=np.float64)
+    v_edge = cv.filter2D(img, cv.CV_64F, VERTICAL_EDGE_FILTER, borderType=cv.BORDER_CONSTANT)
+    h_edge = cv.filter2D(img, cv.CV_64F, HORIZONTAL_EDGE_FILTER, borderType=cv.BORDER_CONSTANT)
+    return cv.magnitude(v_edge, h_edge)
 
 def sobel_edge_detection_img(image):
     """
@@ -101,13 +124,81 @@ def sobel_edge_detection_img(image):
     :param img: image to be used
     """
     new_img = np.full_like(image, 1)
-    for row in range(3, image.shape[0] - 3):
-        for pixel in range(3, image.shape[1] - 3):
-            new_img[row][pixel] = find_sobel_edge(image, [pixel, row])
+    response = sobel_edge_response(image)[3:-3, 3:-3]
+    if np.issubdtype(new_img.dtype, np.integer):
+        response = response.astype(np.int64)
+    new_img[3:-3, 3:-3] = response.astype(new_img.dtype)
     
     return new_img
 
-def canny_edge(image, t1=100, t2=120, dilation=1):
+@lru_cache(maxsize=16)
+def intensity_lut(low, high, size=65536):
+    """
+    Lookup table mapping the intensities of an integer image to 0-255, with
+    low mapped to 0 and high to 255. Intensities outside are clipped.
+
+    :param low: intensity mapped to 0
+    :param high: intensity mapped to 255
+    :param size: number of intensities (65536 for uint16 images)
+    """
+    lut = np.arange(size, dtype=np.float64) - low
+    lut *= (255.0/max(high - low, 1))
+    np.clip(lut, 0, 255, out=lut)
+    lut = np.uint8(lut)
+    lut.flags.writeable = False
+    return lut
+
+def normalize_intensity(image, window=None):
+    """
+    Maps an image to uint8, with the intensity window stretched over 0-255.
+    uint8 and uint16 images go through a lookup table in a single pass.
+
+    :param image: image to be normalized
+    :param window: (low, high) intensities mapped to 0 and 255, (0, image max) if none is given
+    """
+    if window is None:
+        window = (0, image.max())
+    low, high = window
+    if image.dtype in (np.uint8, np.uint16):
+        return intensity_lut(int(low), int(high), np.iinfo(image.dtype).max + 1)[image]
+
+    img = image.astype('float64') - low
+    img *= (255.0/max(high - low, 1))
+    return np.uint8(np.clip(img, 0, 255))
+
+def sobel_edge(image, t1=100, t2=120, dilation=1, window=None):
+    """
+    Sobel alternative to canny_edge. The image is normalized between 0 and 255
+    and the gradient magnitude is scaled so that a full contrast straight edge
+    is 255, pixels above t2 are edges and pixels above t1 are edges if they
+    are connected to one. If necessary, it dilates the edges.
+
+    :param img: image to be used
+    :param t1: lower threshold for the edge detection (0-255)
+    :param t2: higher threshold for the edge detection (0-255)
+    :param dilation: size of dilation kernel (size 1 means no dilation)
+    :param window: (low, high) intensities normalized to 0 and 255, (0, image max)
+        if none is given. Use the same window for all the slices of a volume so
+        edges do not depend on the brightest pixel of each slice.
+    """
+    img = np.asarray(normalize_intensity(image, window), dtype=np.float32)
+    v_edge = cv.filter2D(img, cv.CV_32F, VERTICAL_EDGE_FILTER, borderType=cv.BORDER_REPLICATE)
+    h_edge = cv.filter2D(img, cv.CV_32F, HORIZONTAL_EDGE_FILTER, borderType=cv.BORDER_REPLICATE)
+    magnitude = cv.magnitude(v_edge, h_edge)
+    # Fixed scale, so the thresholds mean the same on every slice
+    magnitude *= 255.0 / SOBEL_MAX_RESPONSE
+
+    # Hysteresis: keep weak edge regions which contain a strong edge
+    weak = np.uint8(magnitude >= t1)
+    count, labels = cv.connectedComponents(weak, connectivity=8)
+    strong_labels = np.zeros(count, dtype=bool)
+    strong_labels[labels[magnitude >= t2]] = True
+    strong_labels[0] = False
+    edge_img = np.where(strong_labels[labels], np.uint8(255), np.uint8(0))
+
+    return cv.dilate(edge_img, np.ones((dilation, dilation), np.uint8), iterations=1)
+
+def canny_edge(image, t1=100, t2=120, dilation=1, window=None):
     """
     Wrapper around OpenCV's canny edge detection to convert nparray to the 
     right format and normalize it between 0 and 255 before sending to the
@@ -117,10 +208,11 @@ def canny_edge(image, t1=100, t2=120, dilation=1):
     :param t1: threshold 1 for the edge detection
     :param t2: threhold 2 for the edge detection
     :param dilation: size of dilation kernel (size 1 means no dilation)
+    :param window: (low, high) intensities normalized to 0 and 255, (0, image max)
+        if none is given. Use the same window for all the slices of a volume so
+        edges do not depend on the brightest pixel of each slice.
     """
-    img = image.astype('float64')
-    img *= (255.0/img.max())
-    img = np.uint8(img)
+    img = normalize_intensity(image, window)
 
     edge_img = cv.Canny(image=img, threshold1=t1, threshold2=t2)
 
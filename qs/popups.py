@@ -1,16 +1,51 @@
 from PyQt6 import QtCore, QtGui, QtWidgets
 from PyQt6.QtCore import Qt
 import plotly.graph_objects as go
-import cv2 as cv
 import numpy as np
-from qs.math import find_sobel_edge
+from qs.data.cache import LRUCache
+from qs.math import find_sobel_edge, normalize_intensity
+from qs.edges import EDGE_DETECTORS
 from qs.interpolation import full_interpolation, verify_full_interpolation
 from matplotlib import pyplot as plt
 from matplotlib.backends.backend_qtagg import (FigureCanvasQTAgg as FigCanvas,
                                                NavigationToolbar2QT as NavigationToolbar)
 
+# Byte budget of the edge images kept by the advanced settings preview
+PREVIEW_CACHE_BYTES = 256 * 1024 ** 2
+
+# Delay before the preview follows the sliders, in milliseconds
+PREVIEW_DEBOUNCE_MS = 150
+
+
+def downsample_max(img: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Shrink an image by taking the maximum of factor x factor blocks, so thin
+    edges stay visible
+
+    :param img: (height, width) image
+    :param factor: shrinking factor
+    """
+    if factor <= 1:
+        return img
+    height, width = img.shape
+    pad = ((0, -height % factor), (0, -width % factor))
+    img = np.pad(img, pad)
+    return img.reshape(img.shape[0] // factor, factor,
+                       img.shape[1] // factor, factor).max(axis=(1, 3))
+
+
 class MyPopup(QtWidgets.QWidget):
-    def __init__(self, image: np.array):
+    def __init__(self, image: np.array, edge_threshold1=100, edge_threshold2=110,
+                 window=None, edge_method='canny', dilation=1):
+        """
+        :param image: slice previewed
+        :param edge_threshold1: initial lower edge threshold
+        :param edge_threshold2: initial higher edge threshold
+        :param window: (low, high) intensity window of the volume, so the
+            preview matches the edges of the slice view
+        :param edge_method: edge detector, one of EDGE_DETECTORS
+        :param dilation: size of dilation kernel (size 1 means no dilation)
+        """
         super().__init__()
         self.window_width = 400
         self.window_height = 400
@@ -21,12 +56,13 @@ class MyPopup(QtWidgets.QWidget):
         self.ax = self.canvas.figure.subplots()
         self.ax.tick_params(labelcolor='white', colors='white')
 
-        # set images
-        self.source_img = image.astype('float64')
-        self.source_img *= (255.0/self.source_img.max())
-        self.source_img = np.uint8(self.source_img)
-        self.edge_treated_img = cv.Canny(image=self.source_img, threshold1=100, threshold2=110)
-        self.ax.imshow(self.edge_treated_img)
+        # set images, normalized once for every threshold
+        self.source_img = normalize_intensity(image, window)
+        self.edge_method = edge_method
+        self.dilation = dilation
+        # Edge images by thresholds and downsampling factor
+        self.edge_cache = LRUCache(PREVIEW_CACHE_BYTES)
+        self.image_artist = None
 
         # Set Layout
         popup_layout = QtWidgets.QHBoxLayout()
@@ -42,24 +78,22 @@ class MyPopup(QtWidgets.QWidget):
         tools_box = QtWidgets.QGroupBox()
         tools_layout = QtWidgets.QVBoxLayout()
         tools_box.setLayout(tools_layout)
-        # Edge limit text box
-        self.edge_limit = QtWidgets.QLineEdit()
-        self.edge_limit.setMaxLength(5)
-        self.edge_limit.setPlaceholderText("0")
-        self.edge_limit.returnPressed.connect(
-            lambda: self.set_edge_limit(int(self.edge_limit.text())))
-        
-        edge_limit_layout = QtWidgets.QHBoxLayout()
-        edge_limit_layout.addWidget(QtWidgets.QLabel("Edge value:"))
-        edge_limit_layout.addWidget(self.edge_limit)
-        tools_layout.addLayout(edge_limit_layout)
+
+        # Updates are delayed until the sliders settle
+        self.preview_timer = QtCore.QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_DEBOUNCE_MS)
+        self.preview_timer.timeout.connect(self.refresh)
+
+        # Edge thresholds and edge limit sliders
+        self.edge_threshold1 = self.add_slider(tools_layout, "Lower edge threshold:", 0, 1000, edge_threshold1)
+        self.edge_threshold2 = self.add_slider(tools_layout, "Higher edge threshold:", 0, 1000, edge_threshold2)
+        self.edge_limit = self.add_slider(tools_layout, "Edge value:", 0, 255, 0)
 
         # Edge search regions
         self.edge_search = QtWidgets.QLineEdit()
         self.edge_search.setMaxLength(5)
         self.edge_search.setPlaceholderText("0")
-        #self.edge_search.returnPressed.connect(
-        #    lambda: self.set_edge_limit(int(self.edge_limit.text())))
         edge_search_layout = QtWidgets.QHBoxLayout()
         edge_search_layout.addWidget(QtWidgets.QLabel("Search size:"))
         edge_search_layout.addWidget(self.edge_search)
@@ -70,6 +104,7 @@ class MyPopup(QtWidgets.QWidget):
         self.save_button.setText('Save settings')
         self.cancel_button = QtWidgets.QPushButton()
         self.cancel_button.setText('Cancel')
+        self.cancel_button.clicked.connect(self.close)
         save_layout = QtWidgets.QHBoxLayout()
         save_layout.addWidget(self.cancel_button)
         save_layout.addWidget(self.save_button)
@@ -83,22 +118,110 @@ class MyPopup(QtWidgets.QWidget):
         popup_layout.addWidget(self.canvas)
         popup_layout.addLayout(settings_layout)
 
+        self.refresh()
+
+    def add_slider(self, layout, label, minimum, maximum, value):
+        """
+        Adds a labelled slider which schedules a preview update when moved
+
+        :param layout: layout the slider is added to
+        :param label: text shown before the slider
+        :param minimum: minimum value of the slider
+        :param maximum: maximum value of the slider
+        :param value: initial value of the slider
+        """
+        slider = QtWidgets.QSlider(Qt.Orientation.Horizontal)
+        slider.setMinimum(minimum)
+        slider.setMaximum(maximum)
+        slider.setValue(value)
+        value_label = QtWidgets.QLabel(str(value))
+        slider.valueChanged.connect(lambda v: value_label.setText(str(v)))
+        slider.valueChanged.connect(self.preview_timer.start)
+
+        slider_layout = QtWidgets.QHBoxLayout()
+        slider_layout.addWidget(QtWidgets.QLabel(label))
+        slider_layout.addWidget(slider)
+        slider_layout.addWidget(value_label)
+        layout.addLayout(slider_layout)
+        return slider
+
+    def preview_factor(self):
+        """
+        Downsampling factor which fits the image to the canvas
+        """
+        ratio = self.canvas.devicePixelRatioF()
+        width = max(1, int(self.canvas.width() * ratio))
+        height = max(1, int(self.canvas.height() * ratio))
+        return max(1, int(np.ceil(max(self.source_img.shape[0] / height,
+                                      self.source_img.shape[1] / width))))
+
+    def edge_preview(self, t1, t2, factor):
+        """
+        Edges of the image, downsampled for display. The edge detector only
+        runs again when the thresholds change.
+
+        :param t1: threshold 1 for the edge detection
+        :param t2: threhold 2 for the edge detection
+        :param factor: downsampling factor
+        """
+        key = (t1, t2, factor)
+        edges = self.edge_cache.get(key)
+        if edges is None:
+            full = self.edge_cache.get((t1, t2, 1))
+            if full is None:
+                full = EDGE_DETECTORS[self.edge_method](
+                    self.source_img, t1, t2, dilation=self.dilation,
+                    window=(0, 255))
+                # Edges within 3 pixels of the border are never shown
+                full[:3] = 0
+                full[-3:] = 0
+                full[:, :3] = 0
+                full[:, -3:] = 0
+                self.edge_cache.put((t1, t2, 1), full)
+            edges = downsample_max(full, factor)
+            self.edge_cache.put(key, edges)
+        return edges
+
+    def refresh(self):
+        """
+        Redraws the preview with the current slider values
+        """
+        self.preview_timer.stop()
+        edges = self.edge_preview(self.edge_threshold1.value(),
+                                  self.edge_threshold2.value(),
+                                  self.preview_factor())
+        # Thresholding after the block maximum is the same as before it
+        display_img = np.where(edges > self.edge_limit.value(), np.uint8(255), np.uint8(0))
+
+        height, width = self.source_img.shape
+        if self.image_artist is None:
+            # Axes keep the full resolution pixel coordinates
+            self.image_artist = self.ax.imshow(
+                display_img, vmin=0, vmax=255, interpolation='nearest',
+                extent=(-0.5, width - 0.5, height - 0.5, -0.5))
+        else:
+            self.image_artist.set_data(display_img)
+        self.canvas.draw_idle()
+
     def set_edge_limit (self, limit):
         """
         Sets the edge based on a limit set by the user
 
         :param limit: limit of the edge detection
         """
+        self.edge_limit.setValue(limit)
+        self.refresh()
 
-        display_img = np.full_like(self.source_img, 0)
-        for row in range(3, self.source_img.shape[0] - 3):
-            for pixel in range(3, self.source_img.shape[1] - 3):
-                    if (self.edge_treated_img[row][pixel] > limit):
-                    #if (find_sobel_edge(self.source_img, [pixel, row]) > limit):
-                        display_img[row][pixel] = 10000
+    def thresholds(self):
+        """
+        Returns the edge thresholds chosen with the sliders
+        """
+        return self.edge_threshold1.value(), self.edge_threshold2.value()
 
-        self.ax.imshow(display_img)
-        self.canvas.draw_idle()
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        # The downsampling factor depends on the canvas size
+        self.preview_timer.start()
 
     def update(self, img):
         self.ax.imshow(img)